@@ -0,0 +1,4 @@
+# Load the Celery app with Django, so web processes can send tasks too
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
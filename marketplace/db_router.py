@@ -0,0 +1,103 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+logger = logging.getLogger(__name__)
+
+_use_replica = ContextVar('use_replica', default=False)
+_replica_lag = {}
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Routes reads issued inside the block to a healthy replica (if any).
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def pin_to_primary(key: str) -> None:
+    """
+    Keeps reads for `key` on the primary for a while after it wrote something,
+    so the client always sees its own writes.
+    """
+    if settings.DATABASE_REPLICAS:
+        cache.set(
+            f'primary-pin:{key}', True, timeout=settings.DATABASE_REPLICA_PIN_SECONDS
+        )
+
+
+def is_pinned_to_primary(key: str) -> bool:
+    return bool(settings.DATABASE_REPLICAS) and bool(cache.get(f'primary-pin:{key}'))
+
+
+def replica_lag(alias: str) -> float:
+    checked_at, lag = _replica_lag.get(alias, (None, None))
+    now = time.monotonic()
+    if checked_at is not None and now - checked_at < settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    try:
+        lag = _query_replica_lag(alias)
+    except Exception as e:
+        logger.warning(f'Unable to check lag of replica {alias}:\n{e}')
+        lag = float('inf')
+
+    _replica_lag[alias] = (now, lag)
+    return lag
+
+
+def _query_replica_lag(alias: str) -> float:
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+
+    # The last replayed transaction gets older while the primary is idle, so a
+    # replica that replayed everything it received isn't lagging
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT CASE WHEN NOT pg_is_in_recovery() '
+            'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+        )
+        lag = cursor.fetchone()[0]
+    return float(lag) if lag is not None else 0
+
+
+class ReplicaRouter:
+    """
+    Sends reads made inside `read_from_replica()` to a random replica whose
+    lag is within `DATABASE_REPLICA_MAX_LAG`. Everything else, including all
+    writes, goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get():
+            return None
+
+        healthy = [
+            alias
+            for alias in settings.DATABASE_REPLICAS
+            if replica_lag(alias) <= settings.DATABASE_REPLICA_MAX_LAG
+        ]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
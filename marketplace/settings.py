@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'product_catalogue.middleware.DeadlineMiddleware',
+    'product_catalogue.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -89,6 +91,38 @@ DATABASES = {
 db_from_env = dj_database_url.config(conn_max_age=1800)
 DATABASES['default'].update(db_from_env)
 
+# Read replicas (comma separated database URLs) used for read-only endpoints
+DATABASE_REPLICAS = []
+for i, replica_url in enumerate(filter(None, getenv('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = f'replica_{i}'
+    DATABASES[alias] = dj_database_url.parse(replica_url.strip(), conn_max_age=1800)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['marketplace.db_router.ReplicaRouter']
+DATABASE_REPLICA_MAX_LAG = float(getenv('DATABASE_REPLICA_MAX_LAG', 5))
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = float(getenv('DATABASE_REPLICA_LAG_CHECK_INTERVAL', 5))
+DATABASE_REPLICA_PIN_SECONDS = int(getenv('DATABASE_REPLICA_PIN_SECONDS', 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Responses to requests with an Idempotency-Key are replayed for this long (seconds)
+IDEMPOTENCY_KEY_TTL = int(getenv('IDEMPOTENCY_KEY_TTL', 24 * 3600))
+# Max time a request may hold its Idempotency-Key before retries can proceed
+IDEMPOTENCY_LOCK_TIMEOUT = int(getenv('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
+# Time budget (seconds) of an API request for its calls to the Offers Microservice (0 = none)
+REQUEST_DEADLINE = float(getenv('REQUEST_DEADLINE', 15))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -160,16 +194,170 @@ LOGGING = {
 # Offers Microservice settings
 OFFERS_SERVICE_BASE_URL = getenv('OFFERS_SERVICE_BASE_URL')
 OFFERS_SERVICE_REFRESH_TOKEN = getenv('OFFERS_SERVICE_REFRESH_TOKEN')
+# Calls are spread over these Refresh Tokens (comma separated), each limited to
+# OFFERS_SERVICE_RATE_LIMIT calls ("num/period", unlimited by default), counted
+# in the cache (per process unless CACHE_BACKEND is shared). Tokens failing
+# OFFERS_SERVICE_CREDENTIAL_MAX_FAILURES times in a row are left out for
+# OFFERS_SERVICE_CREDENTIAL_COOLDOWN seconds
+OFFERS_SERVICE_REFRESH_TOKENS = [
+    token.strip()
+    for token in (
+        getenv('OFFERS_SERVICE_REFRESH_TOKENS') or OFFERS_SERVICE_REFRESH_TOKEN or ''
+    ).split(',')
+    if token.strip()
+]
+OFFERS_SERVICE_RATE_LIMIT = getenv('OFFERS_SERVICE_RATE_LIMIT') or None
+OFFERS_SERVICE_CREDENTIAL_MAX_FAILURES = int(getenv('OFFERS_SERVICE_CREDENTIAL_MAX_FAILURES', 3))
+OFFERS_SERVICE_CREDENTIAL_COOLDOWN = int(getenv('OFFERS_SERVICE_CREDENTIAL_COOLDOWN', 60))
+# Timeout (seconds) of a single call, shortened to what is left of the time budget
+OFFERS_SERVICE_TIMEOUT = float(getenv('OFFERS_SERVICE_TIMEOUT', 10))
+# Reconcile Offers through COPY into a staging table on PostgreSQL
+OFFERS_SYNC_BULK_COPY = getenv('OFFERS_SYNC_BULK_COPY', 'true').lower() == 'true'
+# Decode Offers responses incrementally and reconcile them in batches
+OFFERS_SYNC_STREAMING = getenv('OFFERS_SYNC_STREAMING', 'true').lower() == 'true'
+OFFERS_SYNC_BATCH_SIZE = int(getenv('OFFERS_SYNC_BATCH_SIZE', 1000))
+# Products are picked for a sync cycle in chunks of this many
+OFFERS_SYNC_CHUNK_SIZE = int(getenv('OFFERS_SYNC_CHUNK_SIZE', 500))
+# Products of a chunk are synced by this many threads, one per Refresh Token by default
+OFFERS_SYNC_CONCURRENCY = int(
+    getenv('OFFERS_SYNC_CONCURRENCY', len(OFFERS_SERVICE_REFRESH_TOKENS) or 1)
+)
+# Offer changes pushed to the webhook endpoint, signed with this secret
+OFFERS_WEBHOOK_SECRET = getenv('OFFERS_WEBHOOK_SECRET')
+OFFERS_WEBHOOK_TOLERANCE = int(getenv('OFFERS_WEBHOOK_TOLERANCE', 300))
+# With the webhook enabled polling is only a slower full reconciliation safety net
+FETCH_OFFERS_INTERVAL = int(
+    getenv('FETCH_OFFERS_INTERVAL', 3600 if OFFERS_WEBHOOK_SECRET else 90)
+)
+# Products are synced every `interval` seconds of their tier, picked by the
+# first tier whose read or Offer change rate (per hour) they reach
+OFFERS_SYNC_TIERS = {
+    'hot': {
+        'interval': FETCH_OFFERS_INTERVAL,
+        'reads_per_hour': int(getenv('OFFERS_SYNC_HOT_READS_PER_HOUR', 60)),
+        'changes_per_hour': int(getenv('OFFERS_SYNC_HOT_CHANGES_PER_HOUR', 30)),
+    },
+    'warm': {
+        'interval': FETCH_OFFERS_INTERVAL * 4,
+        'reads_per_hour': int(getenv('OFFERS_SYNC_WARM_READS_PER_HOUR', 1)),
+        'changes_per_hour': int(getenv('OFFERS_SYNC_WARM_CHANGES_PER_HOUR', 1)),
+    },
+    'cold': {
+        'interval': FETCH_OFFERS_INTERVAL * 16,
+    },
+}
+# Max number of Products synced per cycle (0 = unlimited)
+OFFERS_SYNC_BUDGET = int(getenv('OFFERS_SYNC_BUDGET', 0))
+# Product reads counted towards sync tiers are written to the database at most this
+# many seconds after they happened (and when the process exits)
+PRODUCT_READS_FLUSH_INTERVAL = int(getenv('PRODUCT_READS_FLUSH_INTERVAL', 10))
+# Failed syncs are retried after FETCH_OFFERS_INTERVAL doubled per consecutive
+# failure, up to OFFERS_SYNC_MAX_BACKOFF seconds. Products failing
+# OFFERS_SYNC_MAX_FAILURES times in a row (or unknown to the Microservice
+# OFFERS_SYNC_NOT_FOUND_FAILURES times in a row) are dead lettered until
+# requeued in the admin
+OFFERS_SYNC_MAX_BACKOFF = int(getenv('OFFERS_SYNC_MAX_BACKOFF', 6 * 3600))
+OFFERS_SYNC_MAX_FAILURES = int(getenv('OFFERS_SYNC_MAX_FAILURES', 10))
+OFFERS_SYNC_NOT_FOUND_FAILURES = int(getenv('OFFERS_SYNC_NOT_FOUND_FAILURES', 3))
+# Products being synced are claimed for at most this many seconds, so
+# overlapping cycles and on-demand syncs don't sync them twice
+OFFERS_SYNC_CLAIM_TIMEOUT = int(getenv('OFFERS_SYNC_CLAIM_TIMEOUT', 3600))
+# Time budgets (seconds) of a sync cycle and of each Product in it (0 = none).
+# Products left once the cycle's budget runs out stay due for the next cycle
+OFFERS_SYNC_CYCLE_DEADLINE = float(getenv('OFFERS_SYNC_CYCLE_DEADLINE', FETCH_OFFERS_INTERVAL))
+OFFERS_SYNC_PRODUCT_DEADLINE = float(getenv('OFFERS_SYNC_PRODUCT_DEADLINE', 60))
+# Log time per phase of every synced Product and the slowest ones each cycle,
+# with cProfile stats for the given fraction of cycles
+OFFERS_SYNC_PROFILING = getenv('OFFERS_SYNC_PROFILING', 'false').lower() == 'true'
+OFFERS_SYNC_PROFILING_TOP = int(getenv('OFFERS_SYNC_PROFILING_TOP', 10))
+OFFERS_SYNC_PROFILING_CPROFILE_RATE = float(getenv('OFFERS_SYNC_PROFILING_CPROFILE_RATE', 0))
+
+# Server-Sent Events streams of Offer changes. The broker defaults to Postgres
+# LISTEN/NOTIFY, or an in-process broker on other databases
+OFFER_STREAM_BROKER = getenv('OFFER_STREAM_BROKER')
+OFFER_STREAM_HEARTBEAT_INTERVAL = int(getenv('OFFER_STREAM_HEARTBEAT_INTERVAL', 15))
+# Streams are closed after this many seconds, clients reconnect after OFFER_STREAM_RETRY
+OFFER_STREAM_MAX_DURATION = int(getenv('OFFER_STREAM_MAX_DURATION', 300))
+OFFER_STREAM_RETRY = int(getenv('OFFER_STREAM_RETRY', 3))
+# Streams open at once per web process, beyond them streams are refused with 503.
+# Keep it below the web server threads (32, see docker-compose.yml)
+OFFER_STREAM_MAX_CONNECTIONS = int(getenv('OFFER_STREAM_MAX_CONNECTIONS', 16))
+# Messages buffered per stream before a slow client is disconnected
+OFFER_STREAM_QUEUE_SIZE = int(getenv('OFFER_STREAM_QUEUE_SIZE', 1000))
+# Offer changes published per Product sync, beyond them clients only get a `resync`
+# event telling them to reload the Offers of the Product
+OFFER_STREAM_MAX_EVENTS = int(getenv('OFFER_STREAM_MAX_EVENTS', 1000))
 
 # Celery
 CELERY_BROKER_URL = getenv('CELERY_BROKER_URL')
+# Each queue has its own workers (see docker-compose.yml), so latency sensitive
+# tasks never wait behind bulk sync:
+#  - sync: periodic Offers sync cycles and purges of deleted Products
+#  - refresh: on-demand syncs of selected Products
+# Queues take priorities 0-9 (RabbitMQ), higher first
+CELERY_TASK_QUEUES = {
+    queue: {
+        'exchange': queue,
+        'routing_key': queue,
+        'queue_arguments': {'x-max-priority': 9},
+    }
+    for queue in ['sync', 'refresh']
+}
+CELERY_TASK_DEFAULT_QUEUE = 'sync'
+CELERY_TASK_ROUTES = {
+    'product_catalogue.tasks.fetch_offers_task': {'queue': 'sync', 'priority': 5},
+    'product_catalogue.tasks.purge_deleted_products_task': {'queue': 'sync', 'priority': 1},
+    'product_catalogue.tasks.sync_products_task': {'queue': 'refresh', 'priority': 5},
+}
+# Workers reserve one task per process so a long sync doesn't hold others back
+# (the refresh worker raises it, see docker-compose.yml)
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
 CELERY_BEAT_SCHEDULE = {
     'fetch_offers_task': {
         'task': 'product_catalogue.tasks.fetch_offers_task',
-        'schedule': timedelta(seconds=int(getenv('FETCH_OFFERS_INTERVAL', 90))),
+        'schedule': timedelta(seconds=FETCH_OFFERS_INTERVAL),
+        # Cycles a busy worker couldn't start in time are dropped, not piled up
+        'options': {'expires': FETCH_OFFERS_INTERVAL},
+    },
+    # Deleted Products are purged right after deletion, this catches any left over
+    'purge_deleted_products_task': {
+        'task': 'product_catalogue.tasks.purge_deleted_products_task',
+        'schedule': timedelta(hours=1),
     },
 }
+# Max Offers removed per DELETE statement when purging deleted Products
+PRODUCT_PURGE_BATCH_SIZE = int(getenv('PRODUCT_PURGE_BATCH_SIZE', 5000))
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-}
\ No newline at end of file
+    'DEFAULT_RENDERER_CLASSES': [
+        'product_catalogue.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'product_catalogue.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': ['product_catalogue.throttling.WindowRateThrottle'],
+    # Per Access-Token (or IP): `user` for all requests, others per endpoint `throttle_scope`
+    'DEFAULT_THROTTLE_RATES': {
+        'user': getenv('API_RATE_LIMIT_USER', '1200/min'),
+        'products': getenv('API_RATE_LIMIT_PRODUCTS', '600/min'),
+        'product_offers': getenv('API_RATE_LIMIT_PRODUCT_OFFERS', '60/min'),
+        'offers': getenv('API_RATE_LIMIT_OFFERS', '600/min'),
+    },
+}
+
+# OpenAPI schema, prebuilt per code version by the `build_openapi_schema` command
+CODE_VERSION = getenv('CODE_VERSION', 'dev')
+OPENAPI_SCHEMA_DIR = Path(getenv('OPENAPI_SCHEMA_DIR', BASE_DIR / 'openapi'))
+SPECTACULAR_SETTINGS = {
+    # Applies the schema annotations of the views, kept out of the web processes
+    'DEFAULT_GENERATOR_CLASS': 'product_catalogue.openapi.SchemaGenerator',
+}
+
+# Response compression
+RESPONSE_COMPRESSION_MIN_SIZE = int(getenv('RESPONSE_COMPRESSION_MIN_SIZE', 1024))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(getenv('RESPONSE_COMPRESSION_GZIP_LEVEL', 6))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', 5))
\ No newline at end of file
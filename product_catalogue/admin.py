@@ -1,3 +1,243 @@
-from django.contrib import admin
+import uuid
 
-# Register your models here.
+from django.contrib import admin, messages
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .deletion import soft_delete_products
+from .models import Product, Offer, OfferCredentials, User, ProductSyncState
+from .scheduling import requeue_sync_states
+from .search import search_products
+from .sync import close_offers
+from .tasks import purge_deleted_products_task, sync_products_task
+
+
+# Below this many (estimated) rows the exact COUNT(*) is cheap enough
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    On Postgres, counts large changelists from the query planner's row
+    estimate instead of running COUNT(*) over millions of rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            try:
+                sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+            except EmptyResultSet:
+                return 0
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                estimate = cursor.fetchone()[0][0]['Plan']['Plan Rows']
+            if estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return int(estimate)
+        return super().count
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the COUNT(*) of the whole table shown next to filtered results
+    show_full_result_count = False
+    # `search_fields` are UUIDs, looked up exactly so their indexes are used
+    uuid_search = False
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.uuid_search or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+
+        value = _parse_uuid(search_term)
+        if value is None:
+            return queryset.none(), False
+        q = Q()
+        for field in self.search_fields:
+            q |= Q(**{field: value})
+        return queryset.filter(q), False
+
+
+class NullFieldListFilter(admin.SimpleListFilter):
+    field_name = None
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            return queryset.filter(**{f'{self.field_name}__isnull': self.value() == 'no'})
+        return queryset
+
+
+class DeletedFilter(NullFieldListFilter):
+    title = 'deleted'
+    parameter_name = 'deleted'
+    field_name = 'deleted_at'
+
+
+class ClosedFilter(NullFieldListFilter):
+    title = 'closed'
+    parameter_name = 'closed'
+    field_name = 'closed_at'
+
+
+class DeadLetteredFilter(NullFieldListFilter):
+    title = 'dead lettered'
+    parameter_name = 'dead_lettered'
+    field_name = 'dead_lettered_at'
+
+
+@admin.register(Product)
+class ProductAdmin(ScalableModelAdmin):
+    list_display = [
+        'name',
+        'id',
+        'best_price',
+        'open_offer_count',
+        'total_stock',
+        'deleted_at',
+    ]
+    list_filter = [DeletedFilter]
+    search_fields = ['name', 'description']
+    ordering = ['name', 'id']
+    readonly_fields = [
+        'id',
+        'best_price',
+        'avg_price',
+        'open_offer_count',
+        'total_stock',
+        'deleted_at',
+    ]
+    actions = ['sync_offers', 'soft_delete']
+
+    def get_queryset(self, request):
+        # Deleted Products stay visible until they are purged
+        return Product.all_objects.defer('description')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        value = _parse_uuid(search_term)
+        if value is not None:
+            return queryset.filter(id=value), False
+        return search_products(queryset, search_term), False
+
+    def get_actions(self, request):
+        # Deleting would cascade to all Offers in one request, `soft_delete` purges them in batches
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Sync Offers of selected Products', permissions=['change'])
+    def sync_offers(self, request, queryset):
+        product_ids = [str(id) for id in queryset.values_list('id', flat=True)]
+        sync_products_task.delay(product_ids)
+        self.message_user(
+            request, f'Sync of {len(product_ids)} Products was scheduled', messages.SUCCESS
+        )
+
+    @admin.action(description='Delete selected Products', permissions=['delete'])
+    def soft_delete(self, request, queryset):
+        with transaction.atomic():
+            deleted_ids = soft_delete_products(queryset.values_list('id', flat=True))
+            if deleted_ids:
+                transaction.on_commit(
+                    lambda: purge_deleted_products_task.delay([str(id) for id in deleted_ids])
+                )
+        self.message_user(request, f'Deleted {len(deleted_ids)} Products', messages.SUCCESS)
+
+
+@admin.register(Offer)
+class OfferAdmin(ScalableModelAdmin):
+    list_display = ['id', 'product', 'price', 'items_in_stock', 'created_at', 'closed_at']
+    list_filter = [ClosedFilter, ('created_at', admin.DateFieldListFilter)]
+    list_select_related = ['product']
+    search_fields = ['id', 'product_id']
+    uuid_search = True
+    ordering = ['-created_at']
+    actions = ['close']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('product__description')
+
+    @admin.action(description='Close selected Offers (Sold Out)', permissions=['close'])
+    def close(self, request, queryset):
+        closed = close_offers(queryset.values_list('id', flat=True))
+        self.message_user(request, f'Closed {closed} Offers', messages.SUCCESS)
+
+    def has_close_permission(self, request):
+        opts = self.opts
+        return request.user.has_perm(f'{opts.app_label}.{get_permission_codename("change", opts)}')
+
+    # Offers mirror the Offers Microservice and their changes have to reach the
+    # price event log, so they can only be closed through the action above
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OfferCredentials)
+class OfferCredentialsAdmin(admin.ModelAdmin):
+    list_display = ['refresh_token', 'created_at', 'updated_at']
+    readonly_fields = ['refresh_token', 'access_token', 'created_at', 'updated_at']
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(User)
+class UserAdmin(ScalableModelAdmin):
+    list_display = ['email']
+    search_fields = ['=email']
+    readonly_fields = ['access_token']
+    ordering = ['email']
+
+
+@admin.register(ProductSyncState)
+class ProductSyncStateAdmin(ScalableModelAdmin):
+    list_display = [
+        'product',
+        'tier',
+        'next_sync_at',
+        'last_synced_at',
+        'failure_count',
+        'last_failed_at',
+        'dead_lettered_at',
+        'last_error',
+    ]
+    list_filter = [DeadLetteredFilter, 'tier']
+    list_select_related = ['product']
+    search_fields = ['product_id']
+    uuid_search = True
+    ordering = ['next_sync_at']
+    readonly_fields = [field.name for field in ProductSyncState._meta.fields]
+    actions = ['requeue']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('product__description')
+
+    @admin.action(description='Requeue sync of selected Products', permissions=['change'])
+    def requeue(self, request, queryset):
+        requeued = requeue_sync_states(queryset.values_list('product_id', flat=True))
+        self.message_user(request, f'Requeued {requeued} Products', messages.SUCCESS)
+
+    def has_add_permission(self, request):
+        return False
+
+
+def _parse_uuid(value: str):
+    try:
+        return uuid.UUID(value.strip())
+    except ValueError:
+        return None
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProductCatalogueConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'product_catalogue'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,248 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'offer_changes'
+# Keeps Postgres NOTIFY payloads well under their 8000 bytes limit
+MAX_EVENTS_PER_MESSAGE = 40
+RESYNC_EVENT = {'type': 'resync'}
+
+_broker = None
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+def get_broker() -> 'InMemoryBroker':
+    """
+    Returns the shared broker of Offer change messages: OFFER_STREAM_BROKER,
+    or PostgresBroker on Postgres and InMemoryBroker otherwise.
+    """
+    global _broker
+    if _broker is None:
+        broker_path = settings.OFFER_STREAM_BROKER or (
+            'product_catalogue.broadcast.PostgresBroker'
+            if connection.vendor == 'postgresql'
+            else 'product_catalogue.broadcast.InMemoryBroker'
+        )
+        _broker = import_string(broker_path)()
+    return _broker
+
+
+def publish_offer_changes(product_id, events: [dict]) -> None:
+    """
+    Publishes Offer change events ({'type', 'offer'}) of a Product, in as
+    many messages as needed.
+    """
+    broker = get_broker()
+    for i in range(0, len(events), MAX_EVENTS_PER_MESSAGE):
+        broker.publish(
+            {'product_id': str(product_id), 'events': events[i:i + MAX_EVENTS_PER_MESSAGE]}
+        )
+
+
+def offer_change_event(type: str, offer_id, price: int, items_in_stock: int) -> dict:
+    return {
+        'type': type,
+        'offer': {'id': str(offer_id), 'price': price, 'items_in_stock': items_in_stock},
+    }
+
+
+class OfferChanges:
+    """
+    Collects Offer change events of a Product to publish. Beyond
+    OFFER_STREAM_MAX_EVENTS events only a single `resync` event is kept,
+    telling subscribers to reload the Offers of the Product instead.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    @property
+    def resync(self) -> bool:
+        return self.events == [RESYNC_EVENT]
+
+    def add(self, type: str, offer_id, price: int, items_in_stock: int) -> None:
+        if self.resync:
+            return
+        if len(self.events) >= settings.OFFER_STREAM_MAX_EVENTS:
+            self.events = [RESYNC_EVENT]
+            return
+        self.events.append(offer_change_event(type, offer_id, price, items_in_stock))
+
+
+class Subscription:
+    def __init__(self, maxsize: int):
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, message: dict) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # The subscriber can't keep up, it has to reconnect and catch up
+            self.overflowed = True
+
+    def get(self, timeout: float):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InMemoryBroker:
+    """
+    Fans messages out to subscribers of the same process, e.g. in tests or
+    when the Offers sync runs in the web process.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message: dict) -> None:
+        self._deliver(message)
+
+    def _deliver(self, message: dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    @contextmanager
+    def subscribe(self):
+        subscription = Subscription(settings.OFFER_STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscriptions.discard(subscription)
+
+
+class PostgresBroker(InMemoryBroker):
+    """
+    Publishes messages with NOTIFY, so they reach subscribers of every web
+    process. Each process LISTENs on a single dedicated connection in a
+    background thread and fans the messages out to its own subscribers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, message: dict) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, json.dumps(message)])
+
+    @contextmanager
+    def subscribe(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, args=(connection.get_connection_params(),), daemon=True
+                )
+                self._listener.start()
+        with super().subscribe() as subscription:
+            yield subscription
+
+    def _listen(self, connection_params: dict) -> None:
+        while True:
+            try:
+                listen_connection = connection.get_new_connection(connection_params)
+                listen_connection.autocommit = True
+                with listen_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                try:
+                    while True:
+                        if select.select([listen_connection], [], [], 5) == ([], [], []):
+                            continue
+                        listen_connection.poll()
+                        while listen_connection.notifies:
+                            notify = listen_connection.notifies.pop(0)
+                            self._deliver(json.loads(notify.payload))
+                finally:
+                    listen_connection.close()
+            except Exception as e:
+                logger.error(f'Offer changes listener failed, reconnecting:\n{e}')
+                time.sleep(1)
+
+
+def open_offer_stream(product_id=None):
+    """
+    Returns the stream of Offer changes of stream_offer_changes, or None when
+    this process already serves OFFER_STREAM_MAX_CONNECTIONS streams. Every
+    open stream holds a web server thread until it's closed.
+    """
+    global _open_streams
+    with _open_streams_lock:
+        if _open_streams >= settings.OFFER_STREAM_MAX_CONNECTIONS:
+            return None
+        _open_streams += 1
+    return _OfferStream(stream_offer_changes(product_id))
+
+
+class _OfferStream:
+    """
+    Frees the slot of the stream once it's closed, even if it never started.
+    """
+
+    def __init__(self, events):
+        self._events = events
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self) -> None:
+        global _open_streams
+        self._events.close()
+        with _open_streams_lock:
+            if not self._closed:
+                self._closed = True
+                _open_streams -= 1
+
+
+def stream_offer_changes(product_id=None):
+    """
+    Yields Server-Sent Events of Offer changes (of one Product, or all of
+    them), with a comment heartbeat whenever nothing was written for
+    OFFER_STREAM_HEARTBEAT_INTERVAL seconds. The stream ends after
+    OFFER_STREAM_MAX_DURATION seconds, or once the client falls behind, and
+    clients reconnect by themselves.
+    """
+    product_id = str(product_id) if product_id is not None else None
+    deadline = time.monotonic() + settings.OFFER_STREAM_MAX_DURATION
+
+    with get_broker().subscribe() as subscription:
+        yield f'retry: {settings.OFFER_STREAM_RETRY * 1000}\n\n'
+        last_write = time.monotonic()
+        while not subscription.overflowed:
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining <= 0:
+                return
+            # Messages of other Products don't keep the connection alive
+            heartbeat_in = last_write + settings.OFFER_STREAM_HEARTBEAT_INTERVAL - now
+            if heartbeat_in <= 0:
+                yield ': keepalive\n\n'
+                last_write = time.monotonic()
+                continue
+            message = subscription.get(min(remaining, heartbeat_in))
+            if message is not None and (product_id is None or message['product_id'] == product_id):
+                yield f'event: offers\ndata: {json.dumps(message)}\n\n'
+                last_write = time.monotonic()
@@ -0,0 +1,147 @@
+import hashlib
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+
+from .deadlines import DeadlineExceeded, get_remaining
+from .models import OfferCredentials
+from .throttling import WindowRateThrottle
+
+
+logger = logging.getLogger(__name__)
+
+
+class NoCredentialsAvailable(Exception):
+    """
+    None of the Refresh Tokens of the Offers Microservice is configured or
+    healthy.
+    """
+
+
+class CredentialPool:
+    """
+    Spreads calls to the Offers Microservice over the Refresh Tokens in
+    OFFERS_SERVICE_REFRESH_TOKENS, each with its own Access Token. Calls per
+    Refresh Token are limited to OFFERS_SERVICE_RATE_LIMIT per period by
+    counters in the Django cache, shared by all processes only with a shared
+    CACHE_BACKEND (e.g. Redis) and per process otherwise. Refresh Tokens failing
+    OFFERS_SERVICE_CREDENTIAL_MAX_FAILURES times in a row (or rate limited by
+    the Microservice) are left out of this process for
+    OFFERS_SERVICE_CREDENTIAL_COOLDOWN seconds.
+    """
+
+    cache = default_cache
+    timer = time.time
+
+    def __init__(self, refresh_tokens: [str], rate: str = None):
+        self.refresh_tokens = list(dict.fromkeys(str(uuid.UUID(token)) for token in refresh_tokens))
+        self.rate = WindowRateThrottle.parse_rate(rate) if rate else None
+        self._failures = {}
+        self._cooldown_until = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'CredentialPool':
+        return cls(settings.OFFERS_SERVICE_REFRESH_TOKENS, settings.OFFERS_SERVICE_RATE_LIMIT)
+
+    def acquire(self) -> OfferCredentials:
+        """
+        Returns credentials of the next healthy Refresh Token with calls
+        left, waiting (within the time budget) while all of them are rate
+        limited.
+        """
+        while True:
+            refresh_tokens = self.healthy_refresh_tokens()
+            if not refresh_tokens:
+                raise NoCredentialsAvailable('No healthy Offers Microservice credentials')
+
+            start = next(self._turn)
+            wait_time = None
+            for i in range(len(refresh_tokens)):
+                refresh_token = refresh_tokens[(start + i) % len(refresh_tokens)]
+                token_wait_time = self._take_call(refresh_token)
+                if token_wait_time is None:
+                    credentials, _ = OfferCredentials.objects.get_or_create(
+                        refresh_token=refresh_token
+                    )
+                    return credentials
+                wait_time = (
+                    token_wait_time if wait_time is None else min(wait_time, token_wait_time)
+                )
+
+            remaining = get_remaining()
+            if remaining is not None and remaining < wait_time:
+                raise DeadlineExceeded(
+                    'Deadline exceeded waiting for Offers Microservice rate limits'
+                )
+            time.sleep(wait_time)
+
+    def healthy_refresh_tokens(self) -> [str]:
+        now = time.monotonic()
+        return [
+            refresh_token
+            for refresh_token in self.refresh_tokens
+            if self._cooldown_until.get(refresh_token, 0) <= now
+        ]
+
+    def report_success(self, credentials: OfferCredentials) -> None:
+        self._failures.pop(credentials.refresh_token_str, None)
+
+    def report_failure(self, credentials: OfferCredentials, remove: bool = False) -> None:
+        """
+        Counts a failure of the credentials (invalid or failing to refresh),
+        leaving them out for a while once they failed too many times in a row
+        or right away with `remove`. After the cooldown a single failure
+        leaves them out again.
+        """
+        refresh_token = credentials.refresh_token_str
+        with self._lock:
+            failures = self._failures.get(refresh_token, 0) + 1
+            self._failures[refresh_token] = failures
+            if remove or failures >= settings.OFFERS_SERVICE_CREDENTIAL_MAX_FAILURES:
+                self._cooldown_until[refresh_token] = (
+                    time.monotonic() + settings.OFFERS_SERVICE_CREDENTIAL_COOLDOWN
+                )
+                logger.warning(
+                    f'Offers Microservice Refresh Token {refresh_token[:8]}... failed '
+                    f'{failures} times, leaving it out for '
+                    f'{settings.OFFERS_SERVICE_CREDENTIAL_COOLDOWN} seconds'
+                )
+
+    def _take_call(self, refresh_token: str):
+        """
+        Counts a call of the Refresh Token in the current period of its rate
+        limit, returning None or the seconds until the next period if it has
+        no calls left.
+        """
+        if self.rate is None:
+            return None
+
+        capacity, refill_rate = self.rate
+        period = capacity / refill_rate
+        now = self.timer()
+        window = int(now // period)
+        key = (
+            'offers_service_rate:'
+            + hashlib.sha256(refresh_token.encode()).hexdigest()[:32]
+            + f':{window}'
+        )
+        # add and incr are atomic on Redis and Memcached, the lock keeps the
+        # threads of this process from racing on other backends
+        with self._lock:
+            self.cache.add(key, 0, timeout=period + 1)
+            try:
+                calls = self.cache.incr(key)
+            except ValueError:
+                # Expired in between, the period is over anyway
+                self.cache.add(key, 1, timeout=period + 1)
+                calls = 1
+        if calls > capacity:
+            return (window + 1) * period - now
+        return None
@@ -0,0 +1,73 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+from django.conf import settings
+
+
+_deadline = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    The time budget of the API request or sync cycle ran out, so the work
+    was abandoned.
+    """
+
+
+@contextmanager
+def deadline(seconds: float = None):
+    """
+    Gives the block a time budget of `seconds`. Nested budgets can only
+    shorten the one of the enclosing block, None leaves it as it is.
+    """
+    if seconds is None:
+        yield
+        return
+
+    current = _deadline.get()
+    new = monotonic() + seconds
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_remaining() -> float:
+    """
+    Returns the seconds left of the current time budget, or None without one.
+    """
+    current = _deadline.get()
+    return None if current is None else current - monotonic()
+
+
+def deadline_exceeded() -> bool:
+    remaining = get_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def check_deadline() -> None:
+    if deadline_exceeded():
+        raise DeadlineExceeded('Deadline exceeded')
+
+
+def upstream_timeout() -> float:
+    """
+    Returns the timeout of a call to the Offers Microservice: the remaining
+    time budget, capped at OFFERS_SERVICE_TIMEOUT.
+    """
+    check_deadline()
+    remaining = get_remaining()
+    timeout = settings.OFFERS_SERVICE_TIMEOUT
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+def iter_within_deadline(iterable):
+    """
+    Yields items of `iterable` (e.g. chunks of a streamed response) until
+    the time budget runs out. Timeouts of the calls only bound each read.
+    """
+    for item in iterable:
+        check_deadline()
+        yield item
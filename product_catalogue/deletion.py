@@ -0,0 +1,62 @@
+import logging
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Product, Offer, OfferPriceEvent, ProductSyncState
+
+
+logger = logging.getLogger(__name__)
+
+
+def soft_delete_products(product_ids) -> list:
+    """
+    Hides the given Products right away, to be purged later by
+    `purge_deleted_products`. Returns IDs of the Products that were deleted.
+    """
+    deleted_ids = list(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    Product.objects.filter(id__in=deleted_ids).update(deleted_at=datetime.now(timezone.utc))
+    return deleted_ids
+
+
+def purge_deleted_products(product_ids=None) -> int:
+    """
+    Removes soft deleted Products (all of them, or the given ones), deleting
+    their price events and Offers in batches of PRODUCT_PURGE_BATCH_SIZE rows
+    so no statement holds many locks or runs for long. Returns number of purged Products.
+    """
+    products = Product.all_objects.filter(deleted_at__isnull=False)
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    purged = 0
+    for product_id in products.values_list('id', flat=True):
+        _delete_in_batches(OfferPriceEvent, product_id)
+        offers = _delete_in_batches(Offer, product_id)
+        with transaction.atomic():
+            ProductSyncState.objects.filter(product_id=product_id).delete()
+            # No Offers or price events are left to collect, so the cascade is cheap
+            Product.all_objects.filter(id=product_id, deleted_at__isnull=False).delete()
+        logger.info(f'Purged deleted Product {product_id} with {offers} Offers')
+        purged += 1
+    return purged
+
+
+def _delete_in_batches(model, product_id) -> int:
+    table = model._meta.db_table
+    batch_size = settings.PRODUCT_PURGE_BATCH_SIZE
+    product_id = model._meta.get_field('product').get_db_prep_value(product_id, connection)
+    deleted = 0
+
+    while True:
+        # Every batch commits on its own (autocommit)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN ('
+                f'SELECT id FROM {table} WHERE product_id = %s LIMIT %s)',
+                [product_id, batch_size],
+            )
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
@@ -0,0 +1,198 @@
+from datetime import datetime, time, timezone as dt_timezone
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+import uuid
+
+from .search import search_products
+
+
+class ListFilterBackend(BaseFilterBackend):
+    """
+    Only filters the list action. Detail actions look objects up through
+    `get_object`, where the query params of the list don't apply.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) != 'list':
+            return queryset
+        return self.filter_list_queryset(request, queryset, view)
+
+    def filter_list_queryset(self, request, queryset, view):
+        raise NotImplementedError
+
+
+class ProductSearchFilter(ListFilterBackend):
+    search_param = 'search'
+
+    def filter_list_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param)
+        if query is None:
+            return queryset
+        return search_products(queryset, query)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Prefix search over Product name and description, ranked by relevance',
+                'schema': {'type': 'string'},
+            }
+        ]
+
+
+class ProductFilter(ListFilterBackend):
+    """
+    Filters and orders Products by their Offer summary columns:
+    price_min, price_max, in_stock, ordering
+    """
+
+    ordering_fields = ['best_price', 'name']
+
+    def filter_list_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {}
+        errors = {}
+
+        for param, lookup, parse in [
+            ('price_min', 'best_price__gte', int),
+            ('price_max', 'best_price__lte', int),
+            ('in_stock', None, _parse_bool),
+        ]:
+            if param not in params:
+                continue
+            try:
+                value = parse(params[param])
+            except (TypeError, ValueError):
+                errors[param] = f'Invalid value: {params[param]}'
+                continue
+
+            if param == 'in_stock':
+                queryset = (
+                    queryset.filter(open_offer_count__gt=0)
+                    if value
+                    else queryset.filter(open_offer_count=0)
+                )
+            else:
+                filters[lookup] = value
+
+        ordering = params.get('ordering')
+        if ordering is not None and ordering.lstrip('-') not in self.ordering_fields:
+            errors['ordering'] = f'Invalid value: {ordering}'
+
+        if errors:
+            raise ValidationError(errors)
+        queryset = queryset.filter(**filters)
+        if ordering is not None:
+            field = F(ordering.lstrip('-'))
+            # Products without open Offers have no price, keep them last both ways
+            queryset = queryset.order_by(
+                field.desc(nulls_last=True)
+                if ordering.startswith('-')
+                else field.asc(nulls_last=True),
+                'id',
+            )
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            _query_parameter('price_min', 'integer', 'Minimal best price'),
+            _query_parameter('price_max', 'integer', 'Maximal best price'),
+            _query_parameter('in_stock', 'boolean', 'Only Products with / without open Offers'),
+            _query_parameter(
+                'ordering',
+                'string',
+                f'Order by one of {", ".join(self.ordering_fields)} (prefix with - to reverse)',
+            ),
+        ]
+
+
+class OfferFilter(ListFilterBackend):
+    """
+    Filters Offers by query params, each backed by an index on Offer:
+    product, price_min, price_max, in_stock, open, created_after, closed_before
+    """
+
+    def filter_list_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {}
+        errors = {}
+
+        for param, lookup, parse in [
+            ('product', 'product', _parse_uuid),
+            ('price_min', 'price__gte', int),
+            ('price_max', 'price__lte', int),
+            ('in_stock', None, _parse_bool),
+            ('open', 'closed_at__isnull', _parse_bool),
+            ('created_after', 'created_at__gt', _parse_datetime),
+            ('closed_before', 'closed_at__lt', _parse_datetime),
+        ]:
+            if param not in params:
+                continue
+            try:
+                value = parse(params[param])
+            except (TypeError, ValueError):
+                errors[param] = f'Invalid value: {params[param]}'
+                continue
+
+            if param == 'in_stock':
+                queryset = (
+                    queryset.filter(items_in_stock__gt=0)
+                    if value
+                    else queryset.filter(items_in_stock=0)
+                )
+            else:
+                filters[lookup] = value
+
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**filters)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            _query_parameter('product', 'string', 'Only Offers of given Product ID'),
+            _query_parameter('price_min', 'integer', 'Minimal price'),
+            _query_parameter('price_max', 'integer', 'Maximal price'),
+            _query_parameter('in_stock', 'boolean', 'Only Offers with / without items in stock'),
+            _query_parameter('open', 'boolean', 'Only open / closed Offers'),
+            _query_parameter('created_after', 'string', 'Created after (ISO 8601 date or datetime)'),
+            _query_parameter('closed_before', 'string', 'Closed before (ISO 8601 date or datetime)'),
+        ]
+
+
+def _query_parameter(name: str, type: str, description: str) -> dict:
+    return {
+        'name': name,
+        'required': False,
+        'in': 'query',
+        'description': description,
+        'schema': {'type': type},
+    }
+
+
+def _parse_uuid(value: str) -> uuid.UUID:
+    return uuid.UUID(value)
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ('1', 'true'):
+        return True
+    if value.lower() in ('0', 'false'):
+        return False
+    raise ValueError(value)
+
+
+def _parse_datetime(value: str) -> datetime:
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError(value)
+        parsed = datetime.combine(parsed_date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
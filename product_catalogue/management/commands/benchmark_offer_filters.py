@@ -0,0 +1,92 @@
+import random
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from product_catalogue.filters import OfferFilter
+from product_catalogue.models import Product, Offer
+from product_catalogue.serializers import OfferValuesSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the Offer table with random rows (rolled back afterwards) and reports '
+        'timing and query plans of the filtered Offers list queries'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            product_ids = self._fill_tables(options['rows'], options['products'])
+            product_id = random.choice(product_ids)
+
+            for query in [
+                f'product={product_id}',
+                f'product={product_id}&open=true&price_max=2000',
+                f'product={product_id}&in_stock=true',
+                'open=true&price_max=50',
+                'created_after=2023-12-31',
+                'closed_before=2023-01-02',
+            ]:
+                self._report(query, options['repeat'])
+
+            transaction.set_rollback(True)
+
+    def _fill_tables(self, rows: int, products: int) -> [str]:
+        self.stdout.write(f'Inserting {products:,} Products and {rows:,} Offers...')
+        product_ids = [
+            p.id
+            for p in Product.objects.bulk_create(
+                Product(name=f'Product {i}', description='Benchmark') for i in range(products)
+            )
+        ]
+
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        for i in range(0, rows, 10_000):
+            offers = []
+            for _ in range(min(10_000, rows - i)):
+                created_at = start + timedelta(minutes=random.randint(0, 525_600))
+                is_closed = random.random() < 0.8
+                offers.append(
+                    Offer(
+                        price=random.randint(1, 100_000),
+                        items_in_stock=0 if is_closed else random.randint(1, 100),
+                        product_id=random.choice(product_ids),
+                        created_at=created_at,
+                        closed_at=created_at + timedelta(days=1) if is_closed else None,
+                    )
+                )
+            Offer.objects.bulk_create(offers)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Offer._meta.db_table}')
+        return product_ids
+
+    def _report(self, query: str, repeat: int) -> None:
+        request = Request(RequestFactory().get(f'/api/v1/offers/?{query}'))
+        queryset = OfferFilter().filter_queryset(request, Offer.objects.all(), None)
+        # Same query as the paginated Offers list endpoint
+        rows = OfferValuesSerializer.values_list(
+            queryset.order_by('-created_at'), 'created_at'
+        )[:101]
+
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            list(rows.all())
+            timings.append(perf_counter() - started)
+
+        plan = rows.explain()
+        uses_index = 'Seq Scan' not in plan and 'SCAN product_catalogue_offer' not in plan
+        self.stdout.write(
+            f'{query}: {min(timings) * 1000:.2f} ms, '
+            f'{"index" if uses_index else "FULL SCAN"}\n    ' + plan.replace('\n', '\n    ')
+        )
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from time import perf_counter
+
+from product_catalogue.models import Product, Offer
+from product_catalogue.serializers import (
+    ProductSerializer,
+    OfferSerializer,
+    ProductValuesSerializer,
+    OfferValuesSerializer,
+)
+
+
+class Command(BaseCommand):
+    help = 'Compares rows/sec of ModelSerializers and ValuesListSerializers (incl. JSON rendering)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        renderer = JSONRenderer()
+
+        with transaction.atomic():
+            product = Product.objects.create(name='Benchmark', description='Benchmark')
+            Product.objects.bulk_create(
+                Product(name=f'Product {i}', description='Benchmark ' * 20)
+                for i in range(rows - 1)
+            )
+            Offer.objects.bulk_create(
+                Offer(price=i, items_in_stock=i % 50 + 1, product=product)
+                for i in range(rows)
+            )
+
+            cases = [
+                ('products', ProductSerializer, ProductValuesSerializer, Product.objects.all()),
+                ('offers', OfferSerializer, OfferValuesSerializer, product.offers.all()),
+            ]
+            for name, model_serializer, values_serializer, queryset in cases:
+                model_time = self._measure(
+                    lambda: renderer.render(model_serializer(queryset.all(), many=True).data),
+                    repeat,
+                )
+                values_time = self._measure(
+                    lambda: renderer.render(
+                        values_serializer(values_serializer.values_list(queryset.all())).data
+                    ),
+                    repeat,
+                )
+                self.stdout.write(
+                    f'{name}: ModelSerializer {rows / model_time:,.0f} rows/s, '
+                    f'ValuesListSerializer {rows / values_time:,.0f} rows/s '
+                    f'({model_time / values_time:.1f}x)'
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _measure(func, repeat: int) -> float:
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,92 @@
+import json
+import subprocess
+import sys
+from collections import Counter
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+
+# Code run in a fresh interpreter per process type, printing its timings as JSON
+STARTUP_CODE = {
+    'web': '''
+from time import perf_counter
+started = perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+ready = perf_counter()
+from django.test import Client
+Client().get('/api/v1/products/', HTTP_ACCESS_TOKEN='benchmark')
+print(json.dumps({'ready': ready - started, 'first_request': perf_counter() - started}))
+''',
+    'worker': '''
+from time import perf_counter
+started = perf_counter()
+import django
+django.setup()
+from marketplace.celery import app
+app.loader.import_default_modules()
+print(json.dumps({'ready': perf_counter() - started}))
+''',
+    'beat': '''
+from time import perf_counter
+started = perf_counter()
+import django
+django.setup()
+from marketplace.celery import app
+app.conf.beat_schedule
+print(json.dumps({'ready': perf_counter() - started}))
+''',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Starts fresh interpreters the way the web, worker and beat processes do and '
+        'reports their startup time, time to first request and slowest imports '
+        '(from `python -X importtime`)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--process', choices=list(STARTUP_CODE), action='append')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15)
+
+    def handle(self, *args, **options):
+        for process in options['process'] or list(STARTUP_CODE):
+            self._report(process, options['repeat'], options['top'])
+
+    def _report(self, process: str, repeat: int, top: int) -> None:
+        code = 'import json\n' + STARTUP_CODE[process]
+        runs = []
+        for _ in range(repeat):
+            started = perf_counter()
+            timings = json.loads(self._run([sys.executable, '-c', code]).stdout)
+            timings['process'] = perf_counter() - started
+            runs.append(timings)
+
+        self.stdout.write(
+            f'{process}: '
+            + ', '.join(
+                f'{name} {min(run[name] for run in runs) * 1000:.0f} ms'
+                for name in runs[0]
+            )
+        )
+
+        # Self time of every imported module, summed per top-level package
+        import_times = Counter()
+        for line in self._run([sys.executable, '-X', 'importtime', '-c', code]).stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, _, module = line[len('import time:'):].split('|')
+            import_times[module.strip().split('.')[0]] += int(self_us)
+
+        self.stdout.write(f'    imports: {sum(import_times.values()) / 1000:.0f} ms')
+        for package, self_us in import_times.most_common(top):
+            self.stdout.write(f'    {self_us / 1000:8.1f} ms  {package}')
+
+    @staticmethod
+    def _run(command: [str]) -> subprocess.CompletedProcess:
+        return subprocess.run(command, capture_output=True, text=True, check=True)
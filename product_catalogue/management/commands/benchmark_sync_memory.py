@@ -0,0 +1,111 @@
+import gc
+import os
+import resource
+import threading
+from datetime import datetime, timezone
+from time import perf_counter
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from product_catalogue.models import Product, ProductSyncState
+from product_catalogue.profiling import SyncProfiler
+from product_catalogue.tasks import sync_offers_cycle
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs Offers sync cycles over growing numbers of Products (rolled back '
+        'afterwards, with the Offers Microservice stubbed out) and reports the '
+        'peak RSS growth of each cycle'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            default='1000,10000,100000,1000000',
+            help='Comma separated Product counts',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            counts = sorted(int(count) for count in options['products'].split(','))
+        except ValueError:
+            raise CommandError('--products has to be a comma separated list of integers')
+
+        with transaction.atomic(), override_settings(
+            OFFERS_SYNC_BUDGET=0, OFFERS_SYNC_CYCLE_DEADLINE=0
+        ), patch('product_catalogue.tasks.get_offers_service', return_value=_EmptyOffersService()):
+            products = 0
+            for count in counts:
+                self._add_products(count - products)
+                products = count
+                # Every Product is due in the cycle
+                ProductSyncState.objects.update(next_sync_at=datetime.now(timezone.utc))
+                self._report(count)
+
+            transaction.set_rollback(True)
+
+    def _add_products(self, products: int) -> None:
+        for i in range(0, products, 10_000):
+            Product.objects.bulk_create(
+                Product(name=f'Product {j}', description='Benchmark')
+                for j in range(i, min(i + 10_000, products))
+            )
+
+    def _report(self, products: int) -> None:
+        gc.collect()
+        with _PeakRssSampler() as sampler:
+            start = perf_counter()
+            sync_offers_cycle(SyncProfiler(enabled=False))
+            duration = perf_counter() - start
+
+        self.stdout.write(
+            f'{products:>10,} Products: {duration:8.1f} s, '
+            f'RSS {sampler.baseline / 2**20:7.1f} MiB, '
+            f'peak growth {(sampler.peak - sampler.baseline) / 2**20:7.1f} MiB'
+        )
+
+
+class _EmptyOffersService:
+    def get_product_offers(self, product_id):
+        return []
+
+    def iter_product_offers(self, product_id):
+        return iter([])
+
+
+class _PeakRssSampler:
+    """
+    Samples the RSS of the process from /proc, or falls back to the peak
+    RSS of its whole lifetime where /proc isn't available.
+    """
+
+    interval = 0.01
+
+    def __enter__(self):
+        self.baseline = self.peak = _current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+
+def _current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
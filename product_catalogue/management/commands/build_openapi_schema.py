@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from drf_spectacular.renderers import OpenApiJsonRenderer
+
+from product_catalogue.schema import generate_openapi_schema, openapi_schema_path
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes the OpenAPI schema of the current code version (CODE_VERSION) to '
+        'OPENAPI_SCHEMA_DIR, from where the schema endpoint serves it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--code-version', default=settings.CODE_VERSION)
+
+    def handle(self, *args, **options):
+        path = openapi_schema_path(options['code_version'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(OpenApiJsonRenderer().render(generate_openapi_schema()))
+        self.stdout.write(f'Wrote OpenAPI schema to {path}')
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from product_catalogue.profiling import PHASES, SyncProfiler
+from product_catalogue.tasks import sync_offers_cycle
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs one Offers sync cycle (like fetch_offers_task) and reports time per '
+        'phase overall and for the slowest Products'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--cprofile', action='store_true', help='Attach cProfile stats')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        profiler = SyncProfiler(top=options['top'], cprofile=options['cprofile'])
+        sync_offers_cycle(profiler)
+        report = profiler.report()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f'Synced {report["products"]} Products ({report["errors"]} failed) '
+            f'in {report["duration"] * 1000:.0f} ms: '
+            + ', '.join(f'{phase} {report["phases"][phase] * 1000:.0f} ms' for phase in PHASES)
+        )
+        self.stdout.write(f'Slowest {len(report["slowest_products"])} Products:')
+        for entry in report['slowest_products']:
+            self.stdout.write(
+                f'    {entry["total"] * 1000:8.1f} ms  {entry["product"]} {entry["name"]!r}'
+                + ''.join(f'  {phase} {entry[phase] * 1000:.1f}' for phase in PHASES)
+                + ('  ERROR' if entry.get('error') else '')
+            )
+        if 'cprofile' in report:
+            self.stdout.write(report['cprofile'])
@@ -0,0 +1,86 @@
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .deadlines import deadline
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses larger than RESPONSE_COMPRESSION_MIN_SIZE with brotli
+    (if installed) or gzip, depending on the client's Accept-Encoding.
+    Streaming responses are left untouched.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = self._negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        compressed_content = self._compress(response.content, encoding)
+        if len(compressed_content) >= len(response.content):
+            return response
+
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+
+        # Compressed and uncompressed representations can't share a strong ETag
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+
+        return response
+
+    @staticmethod
+    def _negotiate_encoding(accept_encoding: str):
+        accepted = {}
+        for part in accept_encoding.split(','):
+            coding, _, params = part.strip().partition(';')
+            try:
+                quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1
+            except ValueError:
+                quality = 0
+            accepted[coding.strip().lower()] = quality
+
+        supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+        for coding in supported:
+            if accepted.get(coding, accepted.get('*', 0)) > 0:
+                return coding
+        return None
+
+    @staticmethod
+    def _compress(content: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(content, quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)
+        return gzip.compress(
+            content, compresslevel=settings.RESPONSE_COMPRESSION_GZIP_LEVEL, mtime=0
+        )
+
+
+class DeadlineMiddleware:
+    """
+    Gives every request a time budget of REQUEST_DEADLINE seconds, which
+    bounds the timeouts of its calls to the Offers Microservice.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deadline(settings.REQUEST_DEADLINE or None):
+            return self.get_response(request)
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0006_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSyncState',
+            fields=[
+                (
+                    'product',
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name='sync_state',
+                        serialize=False,
+                        to='product_catalogue.product',
+                    ),
+                ),
+                (
+                    'tier',
+                    models.CharField(
+                        choices=[('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold')],
+                        default='hot',
+                        max_length=4,
+                    ),
+                ),
+                (
+                    'next_sync_at',
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ('last_synced_at', models.DateTimeField(default=None, null=True)),
+                ('read_rate', models.FloatField(default=0)),
+                ('churn_rate', models.FloatField(default=0)),
+            ],
+        ),
+    ]
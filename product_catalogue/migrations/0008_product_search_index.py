@@ -0,0 +1,52 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+FTS_TABLE = 'product_catalogue_product_fts'
+
+
+def _search_index():
+    # Must match product_catalogue.search.product_search_vector()
+    return GinIndex(
+        SearchVector('name', weight='A', config='simple')
+        + SearchVector('description', weight='B', config='simple'),
+        name='product_search_idx',
+    )
+
+
+def create_search_index(apps, schema_editor):
+    Product = apps.get_model('product_catalogue', 'Product')
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.add_index(Product, _search_index())
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {FTS_TABLE} '
+            'USING fts5(product_id UNINDEXED, name, description)'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (product_id, name, description) '
+            f'SELECT id, name, description FROM {Product._meta.db_table}'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    Product = apps.get_model('product_catalogue', 'Product')
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.remove_index(Product, _search_index())
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0007_productsyncstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
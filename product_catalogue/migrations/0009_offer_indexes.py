@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0008_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='offer',
+            name='product',
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='offers',
+                to='product_catalogue.product',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(
+                fields=['product', 'price'], name='offer_product_price_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(
+                fields=['product', 'created_at'], name='offer_product_created_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(
+                condition=models.Q(('items_in_stock__gt', 0)),
+                fields=['product'],
+                name='offer_product_in_stock_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(
+                condition=models.Q(('closed_at__isnull', True)),
+                fields=['price'],
+                name='offer_open_price_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['created_at'], name='offer_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['closed_at'], name='offer_closed_at_idx'),
+        ),
+    ]
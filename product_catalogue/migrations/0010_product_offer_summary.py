@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:56
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def calculate_offer_summaries(apps, schema_editor):
+    Product = apps.get_model('product_catalogue', 'Product')
+    Offer = apps.get_model('product_catalogue', 'Offer')
+
+    open_offers = Offer.objects.filter(
+        product=OuterRef('pk'), items_in_stock__gt=0
+    ).values('product')
+    Product.objects.update(
+        best_price=Subquery(open_offers.annotate(v=Min('price')).values('v')),
+        avg_price=Subquery(open_offers.annotate(v=Avg('price')).values('v')),
+        open_offer_count=Coalesce(
+            Subquery(open_offers.annotate(v=Count('id')).values('v')), 0
+        ),
+        total_stock=Coalesce(
+            Subquery(open_offers.annotate(v=Sum('items_in_stock')).values('v')), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0009_offer_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_price',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='best_price',
+            field=models.IntegerField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='open_offer_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(calculate_offer_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0010_product_offer_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='deleted_at',
+            field=models.DateTimeField(db_index=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_price_events(apps, schema_editor):
+    Offer = apps.get_model('product_catalogue', 'Offer')
+    OfferPriceEvent = apps.get_model('product_catalogue', 'OfferPriceEvent')
+    offer_table = Offer._meta.db_table
+    event_table = OfferPriceEvent._meta.db_table
+
+    # Only the last price of each Offer is known. Stock of sold out Offers
+    # before they closed is not, 1 marks them as having been in stock.
+    schema_editor.execute(
+        f'INSERT INTO {event_table} (offer_id, product_id, created_at, price, items_in_stock) '
+        'SELECT id, product_id, created_at, price, '
+        'CASE WHEN items_in_stock > 0 THEN items_in_stock ELSE 1 END '
+        f'FROM {offer_table} ORDER BY created_at'
+    )
+    schema_editor.execute(
+        f'INSERT INTO {event_table} (offer_id, product_id, created_at, price, items_in_stock) '
+        'SELECT id, product_id, COALESCE(closed_at, created_at), price, 0 '
+        f'FROM {offer_table} WHERE items_in_stock <= 0 ORDER BY closed_at'
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0011_product_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferPriceEvent',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('price', models.IntegerField()),
+                ('items_in_stock', models.IntegerField()),
+                (
+                    'offer',
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='price_events',
+                        to='product_catalogue.offer',
+                    ),
+                ),
+                (
+                    'product',
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='price_events',
+                        to='product_catalogue.product',
+                    ),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        fields=['product', 'created_at'], name='price_event_product_idx'
+                    ),
+                    models.Index(fields=['offer'], name='price_event_offer_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_price_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0012_offer_price_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='dead_lettered_at',
+            field=models.DateTimeField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='failure_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='last_failed_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
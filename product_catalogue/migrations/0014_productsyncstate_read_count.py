@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0013_productsyncstate_failures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='read_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+INDEX_NAME = 'product_best_price_desc_idx'
+
+
+def create_best_price_desc_index(apps, schema_editor):
+    # Serves `ordering=-best_price` (see ProductFilter), which keeps Products
+    # without a price last. The plain index is NULLS FIRST when scanned
+    # backwards, and SQLite can't declare NULLS LAST in an index
+    if schema_editor.connection.vendor == 'postgresql':
+        Product = apps.get_model('product_catalogue', 'Product')
+        schema_editor.execute(
+            f'CREATE INDEX {INDEX_NAME} ON {Product._meta.db_table} '
+            '(best_price DESC NULLS LAST, id)'
+        )
+
+
+def drop_best_price_desc_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0014_productsyncstate_read_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_best_price_desc_index, drop_best_price_desc_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0015_product_best_price_desc_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='not_found_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0016_productsyncstate_not_found_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsyncstate',
+            name='claimed_until',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('product_catalogue', '0017_productsyncstate_claimed_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productsyncstate',
+            name='next_sync_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='productsyncstate',
+            index=models.Index(fields=['next_sync_at', 'product'], name='sync_state_next_sync_idx'),
+        ),
+    ]
@@ -3,10 +3,25 @@ from django.utils import timezone
 import uuid
 
 
+class ProductManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Product(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     description = models.TextField()
+    # Deleted Products are hidden right away and purged with their Offers later
+    deleted_at = models.DateTimeField(default=None, null=True, db_index=True)
+    # Summary of open Offers, maintained by the Offers sync
+    best_price = models.IntegerField(default=None, null=True, db_index=True)
+    avg_price = models.FloatField(default=None, null=True)
+    open_offer_count = models.IntegerField(default=0)
+    total_stock = models.IntegerField(default=0)
+
+    objects = ProductManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f'{self.name} ({self.id})'
@@ -17,11 +32,30 @@ class Offer(models.Model):
     price = models.IntegerField()
     items_in_stock = models.IntegerField()
     product = models.ForeignKey(
-        Product, on_delete=models.CASCADE, related_name='offers'
+        # Covered by the (product, price) index
+        Product, on_delete=models.CASCADE, related_name='offers', db_index=False
     )
     created_at = models.DateTimeField(default=timezone.now)
     closed_at = models.DateTimeField(default=None, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'price'], name='offer_product_price_idx'),
+            models.Index(fields=['product', 'created_at'], name='offer_product_created_idx'),
+            models.Index(
+                fields=['product'],
+                condition=models.Q(items_in_stock__gt=0),
+                name='offer_product_in_stock_idx',
+            ),
+            models.Index(
+                fields=['price'],
+                condition=models.Q(closed_at__isnull=True),
+                name='offer_open_price_idx',
+            ),
+            models.Index(fields=['created_at'], name='offer_created_at_idx'),
+            models.Index(fields=['closed_at'], name='offer_closed_at_idx'),
+        ]
+
     @classmethod
     def from_json(cls, json_data, product):
         return cls(
@@ -35,6 +69,44 @@ class Offer(models.Model):
         return f'{self.product.name}: {self.price} ({self.items_in_stock} left)'
 
 
+class OfferPriceEvent(models.Model):
+    """
+    Append-only log of Offer price / stock changes. Each event holds the
+    state of the Offer from `created_at` until its next event, an Offer
+    leaving the market being an event with no items in stock.
+    """
+
+    offer = models.ForeignKey(
+        Offer, on_delete=models.CASCADE, related_name='price_events', db_index=False
+    )
+    # Denormalized from the Offer, so history of a Product is one index range scan
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='price_events', db_index=False
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    price = models.IntegerField()
+    items_in_stock = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='price_event_product_idx'),
+            models.Index(fields=['offer'], name='price_event_offer_idx'),
+        ]
+
+    @classmethod
+    def from_offer(cls, offer: Offer, created_at=None):
+        return cls(
+            offer_id=offer.id,
+            product_id=offer.product_id,
+            created_at=created_at or offer.created_at,
+            price=offer.price,
+            items_in_stock=offer.items_in_stock,
+        )
+
+    def __str__(self):
+        return f'{self.offer_id}: {self.price} ({self.items_in_stock} left) at {self.created_at}'
+
+
 class OfferCredentials(models.Model):
     refresh_token = models.UUIDField(primary_key=True, editable=False)
     access_token = models.CharField(max_length=255)
@@ -49,3 +121,42 @@ class OfferCredentials(models.Model):
 class User(models.Model):
     email = models.EmailField(primary_key=True, editable=False)
     access_token = models.UUIDField(default=uuid.uuid4, editable=False)
+
+
+class ProductSyncState(models.Model):
+    class Tier(models.TextChoices):
+        HOT = 'hot'
+        WARM = 'warm'
+        COLD = 'cold'
+
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='sync_state'
+    )
+    tier = models.CharField(max_length=4, choices=Tier.choices, default=Tier.HOT)
+    next_sync_at = models.DateTimeField(default=timezone.now)
+    last_synced_at = models.DateTimeField(default=None, null=True)
+    # Exponentially weighted averages per hour
+    read_rate = models.FloatField(default=0)
+    churn_rate = models.FloatField(default=0)
+    # Reads since the last sync, added by every web process (see `record_product_read`)
+    read_count = models.IntegerField(default=0)
+    # Failed syncs are retried with exponential backoff (at `next_sync_at`) and
+    # dead lettered once they fail permanently or too many times in a row
+    failure_count = models.IntegerField(default=0)
+    # Consecutive failures because the Microservice doesn't know the Product
+    not_found_count = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    last_failed_at = models.DateTimeField(default=None, null=True)
+    dead_lettered_at = models.DateTimeField(default=None, null=True, db_index=True)
+    # Set while a worker syncs the Product, so concurrent syncs skip it (see
+    # `claim_sync_states`). Expires in case the worker dies
+    claimed_until = models.DateTimeField(default=None, null=True)
+
+    class Meta:
+        indexes = [
+            # Serves the keyset ordered chunks of due Products (see `iter_due_sync_states`)
+            models.Index(fields=['next_sync_at', 'product'], name='sync_state_next_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.tier} (next sync {self.next_sync_at})'
@@ -0,0 +1,87 @@
+from drf_spectacular.generators import SchemaGenerator as SpectacularSchemaGenerator
+from drf_spectacular.openapi import AutoSchema
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    OpenApiExample,
+    OpenApiParameter,
+    extend_schema,
+    extend_schema_view,
+)
+
+from .serializers import ProductDeleteSerializer
+from .views import ProductViewSet, UsersView
+
+
+class AuthenticationSchema(AutoSchema):
+    global_params = [
+        OpenApiParameter(
+            name="Access-Token",
+            type=str,
+            location=OpenApiParameter.HEADER,
+            description="Access token from the `auth` endpoint",
+        )
+    ]
+
+    def get_override_parameters(self):
+        params = super().get_override_parameters()
+        return params + self.global_params
+
+
+class SchemaGenerator(SpectacularSchemaGenerator):
+    """
+    Generates the API schema with the annotations of the views below, which
+    are only applied once this module is imported to generate it.
+    """
+
+
+# Annotating the views when they are defined would load the schema tooling in
+# every web process
+ProductViewSet.schema = AuthenticationSchema()
+extend_schema_view(
+    create=extend_schema(
+        parameters=[
+            OpenApiParameter(name='Idempotency-Key', type=str, location=OpenApiParameter.HEADER, description='Unique key of the request. Retries with the same key return the original response instead of creating another Product'),
+        ],
+    ),
+    retrieve=extend_schema(
+        parameters=[
+            OpenApiParameter(name='includeOffers', type=bool, location=OpenApiParameter.QUERY, description='Return Active Offers for Product'),
+        ],
+    ),
+    destroy=extend_schema(responses={202: ProductDeleteSerializer}),
+    bulk_delete=extend_schema(
+        request=ProductDeleteSerializer, responses={202: ProductDeleteSerializer}
+    ),
+    price_change=extend_schema(
+        parameters=[
+            OpenApiParameter(name='fromDay', type=str, location=OpenApiParameter.QUERY, description='Start Date of comparison (DD.MM.YYYY)'),
+            OpenApiParameter(name='toDay', type=str, location=OpenApiParameter.QUERY, description='End Date of comparison (DD.MM.YYYY). If none provided Present Day will be used'),
+        ],
+    ),
+    stream=extend_schema(
+        operation_id='v1_products_stream_retrieve',
+        description='Server-Sent Events (`offers` events) of new, updated and sold out Offers of the Product',
+        responses={(200, 'text/event-stream'): OpenApiTypes.STR},
+    ),
+    stream_all=extend_schema(
+        operation_id='v1_products_stream_list',
+        description='Server-Sent Events (`offers` events) of new, updated and sold out Offers of all Products',
+        responses={(200, 'text/event-stream'): OpenApiTypes.STR},
+    ),
+)(ProductViewSet)
+
+extend_schema_view(
+    post=extend_schema(
+        examples=[
+            OpenApiExample(
+                'Request Access-Token',
+                summary='Request Access-Token',
+                description='Generates Access-Token for given email.',
+                value={
+                    'email': 'testUser@gmail.com'
+                },
+                request_only=True,
+            ),
+        ]
+    ),
+)(UsersView)
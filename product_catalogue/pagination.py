@@ -0,0 +1,74 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class OptionalLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Paginates only when `limit` is given, so plain list responses keep
+    their shape. Requests using any of `paginated_query_params` (e.g.
+    search) are always paginated, with `default_limit` results per page.
+    """
+
+    default_limit = 20
+    max_limit = 1000
+    paginated_query_params = []
+
+    def get_limit(self, request):
+        if self.limit_query_param in request.query_params:
+            return super().get_limit(request)
+        if any(param in request.query_params for param in self.paginated_query_params):
+            return self.default_limit
+        return None
+
+
+class ProductPagination(OptionalLimitOffsetPagination):
+    paginated_query_params = ['search']
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination without COUNT(*) queries, suitable for
+    huge tables. Like `OptionalLimitOffsetPagination` it is only applied
+    when `limit` or `cursor` is given, or any of `paginated_query_params`.
+    """
+
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    paginated_query_params = []
+
+    @property
+    def position_fields(self) -> [str]:
+        """
+        Extra fields that have to be selected when paginating `values_list()`
+        rows; the cursor position is read from the last column.
+        """
+        ordering = self.ordering if isinstance(self.ordering, str) else self.ordering[0]
+        return [ordering.lstrip('-')]
+
+    def get_page_size(self, request):
+        if (
+            self.page_size_query_param in request.query_params
+            or self.cursor_query_param in request.query_params
+        ):
+            return super().get_page_size(request)
+        if any(param in request.query_params for param in self.paginated_query_params):
+            return self.page_size
+        return None
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, tuple):
+            return str(instance[-1])
+        return super()._get_position_from_instance(instance, ordering)
+
+
+class OfferPagination(OptionalCursorPagination):
+    ordering = '-created_at'
+    paginated_query_params = [
+        'product',
+        'price_min',
+        'price_max',
+        'in_stock',
+        'open',
+        'created_after',
+        'closed_before',
+    ]
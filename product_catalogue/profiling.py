@@ -0,0 +1,161 @@
+import cProfile
+import heapq
+import io
+import pstats
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+
+PHASES = ['fetch', 'db_read', 'diff', 'db_write']
+
+_current_profiler = ContextVar('current_profiler', default=None)
+# Timings of the Product being synced, per thread of a parallel sync
+_current_product = ContextVar('current_product', default=None)
+
+
+def profile_phase(phase: str):
+    """
+    Adds the time spent in the block to `phase` of the Product being synced,
+    if a sync cycle is being profiled.
+    """
+    profiler = _current_profiler.get()
+    return profiler.phase(phase) if profiler is not None else nullcontext()
+
+
+def profile_product(product):
+    """
+    Profiles the sync of `product` in the block, if a sync cycle is being
+    profiled.
+    """
+    profiler = _current_profiler.get()
+    return profiler.product(product) if profiler is not None else nullcontext()
+
+
+def profile_iter(phase: str, iterable):
+    """
+    Like `profile_phase`, for the time spent producing items of `iterable`
+    (e.g. Offer batches streamed from the Offers Microservice).
+    """
+    profiler = _current_profiler.get()
+    if profiler is None:
+        return iterable
+    return profiler.iter(phase, iterable)
+
+
+class SyncProfiler:
+    """
+    Collects time per phase (see PHASES) of each Product synced in a
+    `fetch_offers_task` cycle, keeping the `top` slowest Products and
+    optionally cProfile stats of the whole cycle.
+    """
+
+    def __init__(self, enabled: bool = True, top: int = 10, cprofile: bool = False):
+        self.enabled = enabled
+        self.top = top
+        self.cprofile = cProfile.Profile() if enabled and cprofile else None
+        self.totals = Counter()
+        self.products = 0
+        self.errors = 0
+        self.duration = 0
+        self._slowest = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'SyncProfiler':
+        return cls(
+            enabled=settings.OFFERS_SYNC_PROFILING,
+            top=settings.OFFERS_SYNC_PROFILING_TOP,
+            cprofile=random.random() < settings.OFFERS_SYNC_PROFILING_CPROFILE_RATE,
+        )
+
+    def __enter__(self):
+        if self.enabled:
+            self._token = _current_profiler.set(self)
+            self._started = perf_counter()
+            if self.cprofile is not None:
+                self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            if self.cprofile is not None:
+                self.cprofile.disable()
+            self.duration = perf_counter() - self._started
+            _current_profiler.reset(self._token)
+
+    @contextmanager
+    def product(self, product):
+        if not self.enabled:
+            yield
+            return
+
+        current = {
+            'product': str(product.pk),
+            'name': product.name,
+            **dict.fromkeys(PHASES, 0),
+        }
+        token = _current_product.set(current)
+        started = perf_counter()
+        try:
+            yield
+        except Exception:
+            current['error'] = True
+            raise
+        finally:
+            current['total'] = perf_counter() - started
+            _current_product.reset(token)
+            with self._lock:
+                self.products += 1
+                self.errors += 1 if current.get('error') else 0
+                self.totals.update({phase: current[phase] for phase in PHASES})
+                heapq.heappush(self._slowest, (current['total'], self.products, current))
+                if len(self._slowest) > self.top:
+                    heapq.heappop(self._slowest)
+
+    @contextmanager
+    def phase(self, phase: str):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            current = _current_product.get()
+            if current is not None:
+                current[phase] += perf_counter() - started
+
+    def iter(self, phase: str, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def report(self, cprofile_lines: int = 30) -> dict:
+        report = {
+            'duration': round(self.duration, 4),
+            'products': self.products,
+            'errors': self.errors,
+            'phases': {phase: round(self.totals[phase], 4) for phase in PHASES},
+            'slowest_products': [
+                {
+                    key: round(value, 4) if isinstance(value, float) else value
+                    for key, value in entry.items()
+                }
+                for _, _, entry in sorted(self._slowest, key=lambda item: item[0], reverse=True)
+            ],
+        }
+        if self.cprofile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.cprofile, stream=stream).sort_stats('cumulative').print_stats(
+                cprofile_lines
+            )
+            report['cprofile'] = stream.getvalue()
+        return report
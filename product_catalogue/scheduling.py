@@ -0,0 +1,328 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+from .models import Product, ProductSyncState
+from .services import ProductNotFoundError
+
+
+logger = logging.getLogger(__name__)
+
+EWMA_WEIGHT = 0.3
+
+_pending_reads = Counter()
+_pending_reads_lock = threading.Lock()
+_flush_timer = None
+
+
+def record_product_read(product_id) -> None:
+    """
+    Counts a read of the Product. Reads are buffered in the process and added
+    to the `read_count` of sync states at most PRODUCT_READS_FLUSH_INTERVAL
+    seconds later (or when the process exits), where the sync workers pick
+    them up.
+    """
+    global _flush_timer
+    with _pending_reads_lock:
+        _pending_reads[product_id] += 1
+        if _flush_timer is None:
+            # Flushed in the background, so reads are written even once traffic stops
+            _flush_timer = threading.Timer(
+                settings.PRODUCT_READS_FLUSH_INTERVAL, _flush_product_reads_in_background
+            )
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+def _flush_product_reads_in_background() -> None:
+    global _flush_timer
+    with _pending_reads_lock:
+        _flush_timer = None
+    try:
+        _try_flush_product_reads()
+    finally:
+        # Database connections are per thread and would be left open otherwise
+        connection.close()
+
+
+@atexit.register
+def _try_flush_product_reads() -> None:
+    # Also runs when a web process is recycled or shut down, for reads still buffered
+    try:
+        flush_product_reads()
+    except Exception as e:
+        logger.error(f'Unable to flush Product reads:\n{e}')
+
+
+def flush_product_reads() -> None:
+    with _pending_reads_lock:
+        reads = dict(_pending_reads)
+        _pending_reads.clear()
+    if not reads:
+        return
+
+    _create_missing_sync_states(
+        Product.all_objects.filter(id__in=list(reads)), datetime.now(timezone.utc)
+    )
+    # One UPDATE per distinct count, most Products are read only a few times
+    for count, product_ids in _group_by_count(reads).items():
+        ProductSyncState.objects.filter(product_id__in=product_ids).update(
+            read_count=F('read_count') + count
+        )
+
+
+
+def get_due_sync_states(now: datetime) -> [ProductSyncState]:
+    """
+    Returns sync states (with their Product) of Products due for a sync
+    according to their tier, most overdue first and limited to
+    OFFERS_SYNC_BUDGET Products per cycle.
+    """
+    return [state for chunk in iter_due_sync_states(now) for state in chunk]
+
+
+def iter_due_sync_states(now: datetime):
+    """
+    Like `get_due_sync_states`, but yields the sync states in keyset ordered
+    chunks of OFFERS_SYNC_CHUNK_SIZE, so a cycle holds one chunk in memory
+    at a time. States of a chunk may be rescheduled before the next chunk
+    is fetched.
+    """
+    _create_missing_sync_states(Product.objects.all(), now)
+
+    # Tolerate beat ticking slightly early so Products aren't skipped a whole cycle
+    slack = timedelta(seconds=settings.FETCH_OFFERS_INTERVAL * 0.05)
+    states = _sync_states_with_product().filter(
+        _unclaimed(now),
+        next_sync_at__lte=now + slack,
+        product__deleted_at__isnull=True,
+        dead_lettered_at__isnull=True,
+    ).order_by('next_sync_at', 'product_id')
+    remaining = settings.OFFERS_SYNC_BUDGET or None
+
+    while remaining is None or remaining > 0:
+        chunk_size = settings.OFFERS_SYNC_CHUNK_SIZE
+        chunk = list(states[: chunk_size if remaining is None else min(chunk_size, remaining)])
+        if not chunk:
+            return
+        # Taken before the chunk gets rescheduled
+        last_sync_at, last_product_id = chunk[-1].next_sync_at, chunk[-1].product_id
+        yield chunk
+
+        if remaining is not None:
+            remaining -= len(chunk)
+        states = states.filter(
+            Q(next_sync_at__gt=last_sync_at)
+            | Q(next_sync_at=last_sync_at, product_id__gt=last_product_id)
+        )
+
+
+def get_sync_states(product_ids) -> [ProductSyncState]:
+    """
+    Returns sync states (with their Product) of the given Products, unless
+    deleted.
+    """
+    _create_missing_sync_states(
+        Product.objects.filter(id__in=product_ids), datetime.now(timezone.utc)
+    )
+    return list(
+        _sync_states_with_product().filter(
+            product_id__in=product_ids, product__deleted_at__isnull=True
+        )
+    )
+
+
+def claim_sync_states(states: [ProductSyncState], now: datetime) -> [ProductSyncState]:
+    """
+    Claims the sync states for a sync by this worker for at most
+    OFFERS_SYNC_CLAIM_TIMEOUT seconds, returning those that no other sync
+    (e.g. an overlapping cycle or an on-demand sync) holds. `reschedule`
+    and `release_sync_states` end the claim.
+    """
+    claimed_until = now + timedelta(seconds=settings.OFFERS_SYNC_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        # Rows another worker is claiming right now are skipped rather than waited for
+        claimed_ids = set(
+            ProductSyncState.objects.select_for_update(skip_locked=True)
+            .filter(_unclaimed(now), product_id__in=[state.product_id for state in states])
+            .values_list('product_id', flat=True)
+        )
+        ProductSyncState.objects.filter(product_id__in=claimed_ids).update(
+            claimed_until=claimed_until
+        )
+
+    claimed = [state for state in states if state.product_id in claimed_ids]
+    for state in claimed:
+        state.claimed_until = claimed_until
+    return claimed
+
+
+def release_sync_states(states: [ProductSyncState]) -> None:
+    """
+    Ends the claim of sync states left unsynced, keeping them due.
+    """
+    ProductSyncState.objects.filter(product_id__in=[state.product_id for state in states]).update(
+        claimed_until=None
+    )
+
+
+def _unclaimed(now: datetime) -> Q:
+    return Q(claimed_until__isnull=True) | Q(claimed_until__lte=now)
+
+
+def _sync_states_with_product():
+    # The sync only needs the name of the Product besides its id
+    return ProductSyncState.objects.select_related('product').only(
+        *[field.name for field in ProductSyncState._meta.concrete_fields], 'product__name'
+    )
+
+
+def _create_missing_sync_states(products, now: datetime) -> None:
+    # Keyset paged, so each chunk's anti-join resumes after the previous one
+    # instead of scanning the Products that just got their states again
+    missing_ids = (
+        products.filter(sync_state__isnull=True).order_by('id').values_list('id', flat=True)
+    )
+    last_id = None
+    while True:
+        page = missing_ids if last_id is None else missing_ids.filter(id__gt=last_id)
+        chunk = list(page[: settings.OFFERS_SYNC_CHUNK_SIZE])
+        if not chunk:
+            return
+        last_id = chunk[-1]
+        ProductSyncState.objects.bulk_create(
+            [ProductSyncState(product_id=product_id, next_sync_at=now) for product_id in chunk],
+            ignore_conflicts=True,
+        )
+
+
+def reschedule(
+    states: [ProductSyncState], changes: dict, now: datetime, failures: dict = None
+) -> None:
+    """
+    Updates read and churn rates of synced Products (`changes` maps Product
+    id to number of changed Offers) and schedules their next sync based on
+    the resulting tier. Products whose sync failed (`failures` maps Product
+    id to the exception) are retried with backoff instead.
+    """
+    failures = failures or {}
+    flush_product_reads()
+    # Reads of failed Products are kept for their next successful sync
+    reads = dict(
+        ProductSyncState.objects.filter(
+            product_id__in=[
+                state.product_id for state in states if state.product_id not in failures
+            ],
+            read_count__gt=0,
+        ).values_list('product_id', 'read_count')
+    )
+
+    for state in states:
+        state.claimed_until = None
+        if state.product_id in failures:
+            _record_failure(state, failures[state.product_id], now)
+            continue
+
+        tier_interval = settings.OFFERS_SYNC_TIERS[state.tier]['interval']
+        since = state.last_synced_at or now - timedelta(seconds=tier_interval)
+        elapsed_hours = max((now - since).total_seconds(), 1) / 3600
+
+        state.read_rate = _ewma(
+            state.read_rate, reads.get(state.product_id, 0) / elapsed_hours
+        )
+        state.churn_rate = _ewma(
+            state.churn_rate, changes.get(state.product_id, 0) / elapsed_hours
+        )
+        state.tier = _tier(state.read_rate, state.churn_rate)
+        state.last_synced_at = now
+        state.next_sync_at = now + timedelta(
+            seconds=settings.OFFERS_SYNC_TIERS[state.tier]['interval']
+        )
+        state.failure_count = 0
+        state.not_found_count = 0
+
+    ProductSyncState.objects.bulk_update(
+        states,
+        [
+            'read_rate',
+            'churn_rate',
+            'tier',
+            'last_synced_at',
+            'next_sync_at',
+            'failure_count',
+            'not_found_count',
+            'last_error',
+            'last_failed_at',
+            'dead_lettered_at',
+            'claimed_until',
+        ],
+    )
+    # Only the counted reads are taken, reads recorded meanwhile stay for the next sync
+    for count, product_ids in _group_by_count(reads).items():
+        ProductSyncState.objects.filter(product_id__in=product_ids).update(
+            read_count=F('read_count') - count
+        )
+
+
+def requeue_sync_states(product_ids) -> int:
+    """
+    Takes Products out of the dead letter list (or backoff) and makes them
+    due right away. Returns number of requeued Products.
+    """
+    return ProductSyncState.objects.filter(product_id__in=product_ids).update(
+        failure_count=0,
+        not_found_count=0,
+        dead_lettered_at=None,
+        next_sync_at=datetime.now(timezone.utc),
+    )
+
+
+def _record_failure(state: ProductSyncState, error: Exception, now: datetime) -> None:
+    state.failure_count += 1
+    # A single 404 may come from a Microservice deployment in progress
+    state.not_found_count = (
+        state.not_found_count + 1 if isinstance(error, ProductNotFoundError) else 0
+    )
+    state.last_error = f'{type(error).__name__}: {error}'[:2000]
+    state.last_failed_at = now
+
+    if (
+        state.not_found_count >= settings.OFFERS_SYNC_NOT_FOUND_FAILURES
+        or state.failure_count >= settings.OFFERS_SYNC_MAX_FAILURES
+    ):
+        state.dead_lettered_at = now
+        logger.warning(f'Dead lettered sync of Product {state.product_id}: {state.last_error}')
+        return
+
+    backoff = settings.FETCH_OFFERS_INTERVAL * 2 ** (state.failure_count - 1)
+    state.next_sync_at = now + timedelta(
+        seconds=min(backoff, settings.OFFERS_SYNC_MAX_BACKOFF)
+    )
+
+
+def _tier(read_rate: float, churn_rate: float) -> str:
+    for tier in (ProductSyncState.Tier.HOT, ProductSyncState.Tier.WARM):
+        thresholds = settings.OFFERS_SYNC_TIERS[tier]
+        if (
+            read_rate >= thresholds['reads_per_hour']
+            or churn_rate >= thresholds['changes_per_hour']
+        ):
+            return tier
+    return ProductSyncState.Tier.COLD
+
+
+def _ewma(average: float, value: float) -> float:
+    return EWMA_WEIGHT * value + (1 - EWMA_WEIGHT) * average
+
+
+def _group_by_count(counts: dict) -> dict:
+    grouped = defaultdict(list)
+    for key, count in counts.items():
+        grouped[count].append(key)
+    return grouped
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_schemas = {}
+_rendered_schemas = {}
+
+
+def openapi_schema_path(version: str = None) -> Path:
+    return settings.OPENAPI_SCHEMA_DIR / f'schema-{version or settings.CODE_VERSION}.json'
+
+
+def generate_openapi_schema() -> dict:
+    from drf_spectacular.settings import spectacular_settings
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+
+
+def get_openapi_schema() -> dict:
+    """
+    Returns the OpenAPI schema of the running code version, read from the
+    file written by `build_openapi_schema` or, if there is none, generated
+    once per process.
+    """
+    version = settings.CODE_VERSION
+    if version not in _schemas:
+        path = openapi_schema_path(version)
+        if path.exists():
+            _schemas[version] = json.loads(path.read_bytes())
+        else:
+            logger.warning(f'No prebuilt OpenAPI schema at {path}, generating it')
+            _schemas[version] = generate_openapi_schema()
+    return _schemas[version]
+
+
+def render_openapi_schema(renderer) -> (bytes, str):
+    """
+    Returns the schema rendered by `renderer` and its ETag, both cached per
+    code version and renderer.
+    """
+    key = (settings.CODE_VERSION, type(renderer))
+    if key not in _rendered_schemas:
+        content = renderer.render(get_openapi_schema())
+        _rendered_schemas[key] = (content, f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+    return _rendered_schemas[key]
@@ -0,0 +1,28 @@
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from drf_spectacular.views import SpectacularAPIView
+
+from .schema import render_openapi_schema
+
+
+# Serves the prebuilt OpenAPI schema (see `build_openapi_schema`) instead of
+# generating it on every request, with ETag support. No docstring, as it would
+# replace the endpoint description in the schema.
+class SchemaView(SpectacularAPIView):
+    def _get_schema_response(self, request):
+        if request.GET.get('lang'):
+            return super()._get_schema_response(request)
+
+        content, etag = render_openapi_schema(request.accepted_renderer)
+        charset = request.accepted_renderer.charset
+        response = HttpResponse(
+            content,
+            content_type=f'{request.accepted_media_type}; charset={charset}'
+            if charset
+            else request.accepted_media_type,
+        )
+        response['ETag'] = etag
+        response['Content-Disposition'] = (
+            f'inline; filename="{self._get_filename(request, None)}"'
+        )
+        return get_conditional_response(request, etag=etag, response=response) or response
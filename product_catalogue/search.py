@@ -0,0 +1,85 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+
+FTS_TABLE = 'product_catalogue_product_fts'
+MAX_SEARCH_TERMS = 8
+
+
+def product_search_vector():
+    # Must match the expression of the GIN index created in migration 0008
+    return SearchVector('name', weight='A', config='simple') + SearchVector(
+        'description', weight='B', config='simple'
+    )
+
+
+def search_products(queryset, query: str):
+    """
+    Filters `queryset` to Products whose name or description contain words
+    starting with each term of `query`, ordered by relevance.
+    """
+    terms = re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+    if not terms:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        search_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms), search_type='raw', config='simple'
+        )
+        return (
+            queryset.annotate(search_vector=product_search_vector())
+            .filter(search_vector=search_query)
+            .annotate(search_rank=SearchRank(product_search_vector(), search_query))
+            .order_by('-search_rank', 'id')
+        )
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        product_table = Product._meta.db_table
+        return (
+            queryset.filter(
+                id__in=RawSQL(
+                    f'SELECT product_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]
+                )
+            )
+            .annotate(
+                search_rank=RawSQL(
+                    f'(SELECT -bm25({FTS_TABLE}, 0, 10, 1) FROM {FTS_TABLE} '
+                    f'WHERE {FTS_TABLE} MATCH %s AND product_id = {product_table}.id)',
+                    [match],
+                )
+            )
+            .order_by('-search_rank', 'id')
+        )
+
+    for term in terms:
+        queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term))
+    return queryset
+
+
+def index_product(product: Product, using: str) -> None:
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE product_id = %s', [product.pk.hex])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (product_id, name, description) VALUES (%s, %s, %s)',
+            [product.pk.hex, product.name, product.description],
+        )
+
+
+def unindex_product(product: Product, using: str) -> None:
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE product_id = %s', [product.pk.hex])
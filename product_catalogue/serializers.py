@@ -1,4 +1,12 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import (
+    ModelSerializer,
+    Serializer,
+    ChoiceField,
+    IntegerField,
+    ListField,
+    UUIDField,
+    ValidationError,
+)
 
 from .models import Product, Offer, User
 
@@ -6,7 +14,23 @@ from .models import Product, Offer, User
 class ProductSerializer(ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description']
+        fields = [
+            'id',
+            'name',
+            'description',
+            'best_price',
+            'avg_price',
+            'open_offer_count',
+            'total_stock',
+        ]
+        read_only_fields = ['best_price', 'avg_price', 'open_offer_count', 'total_stock']
+
+    def update(self, instance, validated_data):
+        # Save only the edited fields so a concurrent Offers sync isn't overwritten
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
 
 
 class OfferSerializer(ModelSerializer):
@@ -15,7 +39,61 @@ class OfferSerializer(ModelSerializer):
         fields = ['id', 'price', 'items_in_stock', 'product']
 
 
+class ProductDeleteSerializer(Serializer):
+    ids = ListField(child=UUIDField(), allow_empty=False, max_length=10000)
+
+
+class OfferEventOfferSerializer(Serializer):
+    id = UUIDField()
+    price = IntegerField(required=False)
+    items_in_stock = IntegerField(required=False)
+
+
+class OfferEventSerializer(Serializer):
+    type = ChoiceField(choices=['created', 'updated', 'sold_out'])
+    product_id = UUIDField()
+    offer = OfferEventOfferSerializer()
+
+    def validate(self, data):
+        offer = data['offer']
+        if data['type'] != 'sold_out' and ('price' not in offer or 'items_in_stock' not in offer):
+            raise ValidationError(
+                f'"{data["type"]}" events require Offer price and items_in_stock.'
+            )
+        return data
+
+
 class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ['email', 'access_token']
+
+
+class ValuesListSerializer:
+    """
+    Read-only serializer building the output straight from `values_list()`
+    tuples instead of model instances and per-field DRF serialization.
+    """
+
+    fields = []
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def values_list(cls, queryset, *extra_fields):
+        # Extra trailing columns (e.g. for pagination) are left out of the output
+        return queryset.values_list(*cls.fields, *extra_fields)
+
+    @property
+    def data(self):
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in self.rows]
+
+
+class ProductValuesSerializer(ValuesListSerializer):
+    fields = ProductSerializer.Meta.fields
+
+
+class OfferValuesSerializer(ValuesListSerializer):
+    fields = OfferSerializer.Meta.fields
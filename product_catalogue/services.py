@@ -1,40 +1,110 @@
-import httpx
 from datetime import datetime, timedelta, timezone
 from django.conf import settings
 from rest_framework import status
+from itertools import islice
+import codecs
 import json
 import logging
 
+from .credentials import CredentialPool
+from .deadlines import (
+    DeadlineExceeded,
+    check_deadline,
+    deadline_exceeded,
+    iter_within_deadline,
+    upstream_timeout,
+)
 from .models import OfferCredentials
 
 
 logger = logging.getLogger(__name__)
 
+_offers_service = None
+# Items of streamed JSON arrays (Offers) are never near this large, so
+# malformed input is given up on instead of buffering the rest of the body
+MAX_JSON_VALUE_SIZE = 1024 * 1024
+
+
+class ProductNotFoundError(Exception):
+    """
+    The Offers Microservice doesn't know the Product (e.g. it was deleted
+    there), so retrying won't help.
+    """
+
+
+class RateLimitedError(Exception):
+    """
+    The Offers Microservice rejected the call for exceeding the rate limit
+    of its credentials.
+    """
+
+
+class AccessTokenRefreshError(Exception):
+    """
+    The Offers Microservice refused to issue an Access Token for the Refresh
+    Token.
+    """
+
+
+def get_offers_service() -> 'OffersService':
+    """
+    Returns the shared OffersService, created on first use rather than at
+    import time.
+    """
+    global _offers_service
+    if _offers_service is None:
+        _offers_service = OffersService()
+    return _offers_service
+
 
 class OffersService:
-    _credentials = None
+    def __init__(self):
+        self.base_url = settings.OFFERS_SERVICE_BASE_URL
+        self.credential_pool = CredentialPool.from_settings()
 
     def refresh_token_on_failure(func):
-        def wrap(*args, **kwargs):
-            args[0]._set_credentials()
+        """
+        Calls `func` with credentials from the pool, refreshing their Access
+        Token and retrying once if it's invalid. Credentials that stay
+        invalid, can't be refreshed or are rate limited count as failing.
+        """
+
+        def wrap(self, *args, **kwargs):
+            check_deadline()
+            credentials = self.credential_pool.acquire()
             try:
-                return func(*args, **kwargs)
-            except PermissionError:
-                logger.info('Invalid Access Token. Refreshing...')
-                args[0]._generate_new_access_token()
-                return func(*args, **kwargs)
+                try:
+                    result = func(self, credentials, *args, **kwargs)
+                except PermissionError:
+                    # The refresh and the retry only get what is left of the time budget
+                    logger.info('Invalid Access Token. Refreshing...')
+                    self._generate_new_access_token(credentials)
+                    result = func(self, credentials, *args, **kwargs)
+            except (PermissionError, AccessTokenRefreshError, RateLimitedError) as e:
+                logger.error(f'Encountered Error during {func.__name__}:\n{e}')
+                self.credential_pool.report_failure(
+                    credentials, remove=isinstance(e, RateLimitedError)
+                )
+                raise
             except Exception as e:
                 logger.error(f'Encountered Error during {func.__name__}:\n{e}')
+                if deadline_exceeded() and not isinstance(e, DeadlineExceeded):
+                    raise DeadlineExceeded(f'Deadline exceeded during {func.__name__}') from e
                 raise
 
+            self.credential_pool.report_success(credentials)
+            return result
+
         return wrap
 
     @refresh_token_on_failure
-    def register_product_for_offers(self, product_data: json) -> None:
+    def register_product_for_offers(
+        self, credentials: OfferCredentials, product_data: json
+    ) -> None:
         url = f'{self.base_url}/api/v1/products/register'
-        headers = {'Bearer': self._credentials.access_token}
+        headers = {'Bearer': credentials.access_token}
 
-        with httpx.Client() as client:
+        with self._http_client(upstream_timeout()) as client:
             response = client.post(url, headers=headers, json=product_data)
 
         err_msg = f'Error registering Product with status: {response.status_code}'
@@ -43,61 +113,175 @@ class OffersService:
         )
 
     @refresh_token_on_failure
-    def get_product_offers(self, product_id: str) -> [json]:
+    def get_product_offers(self, credentials: OfferCredentials, product_id: str) -> [json]:
         url = f'{self.base_url}/api/v1/products/{product_id}/offers'
-        headers = {'Bearer': self._credentials.access_token}
+        headers = {'Bearer': credentials.access_token}
 
-        with httpx.Client() as client:
+        with self._http_client(upstream_timeout()) as client:
             response = client.get(url, headers=headers)
 
         err_msg = f'Error fetching Offers for Product {product_id} with status: {response.status_code}'
-        self._handle_response_status(response.status_code, status.HTTP_200_OK, err_msg)
+        self._handle_response_status(
+            response.status_code, status.HTTP_200_OK, err_msg, product_endpoint=True
+        )
 
         return response.json()
 
-    def _generate_new_access_token(self) -> None:
-        self._set_credentials()
+    @refresh_token_on_failure
+    def iter_product_offers(
+        self, credentials: OfferCredentials, product_id: str, batch_size: int = None
+    ):
+        """
+        Streams Offers of a Product, decoding the response body incrementally
+        and yielding lists of at most `batch_size` Offers.
+        """
+        url = f'{self.base_url}/api/v1/products/{product_id}/offers'
+        headers = {'Bearer': credentials.access_token}
 
-        time_diff = datetime.now(timezone.utc) - self._credentials.updated_at
-        if self._credentials.access_token and time_diff < timedelta(minutes=5):
+        client = self._http_client(upstream_timeout())
+        try:
+            response = client.send(client.build_request('GET', url, headers=headers), stream=True)
+            try:
+                err_msg = f'Error fetching Offers for Product {product_id} with status: {response.status_code}'
+                self._handle_response_status(
+                    response.status_code, status.HTTP_200_OK, err_msg, product_endpoint=True
+                )
+            except Exception:
+                response.close()
+                raise
+        except Exception:
+            client.close()
+            raise
+
+        return self._iter_offer_batches(
+            client, response, batch_size or settings.OFFERS_SYNC_BATCH_SIZE
+        )
+
+    @staticmethod
+    def _iter_offer_batches(client, response, batch_size: int):
+        try:
+            offers = _iter_json_array(iter_within_deadline(response.iter_bytes()))
+            while batch := list(islice(offers, batch_size)):
+                yield batch
+        finally:
+            response.close()
+            client.close()
+
+    @staticmethod
+    def _http_client(timeout: float):
+        # httpx (with its async backends) is slow to import and only needed
+        # once the Offers Microservice is actually called
+        import httpx
+
+        return httpx.Client(timeout=timeout)
+
+    def _generate_new_access_token(self, credentials: OfferCredentials) -> None:
+        # Another call may have refreshed the Access Token meanwhile
+        credentials.refresh_from_db()
+
+        time_diff = datetime.now(timezone.utc) - credentials.updated_at
+        if credentials.access_token and time_diff < timedelta(minutes=5):
             logger.info('Access Token appears to be still Valid!')
             return
 
         url = f'{self.base_url}/api/v1/auth'
-        headers = {'Bearer': self._credentials.refresh_token_str}
+        headers = {'Bearer': credentials.refresh_token_str}
 
-        with httpx.Client() as client:
+        with self._http_client(upstream_timeout()) as client:
             response = client.post(url, headers=headers)
 
         if response.status_code == status.HTTP_400_BAD_REQUEST:
             return
         if response.status_code != status.HTTP_201_CREATED:
-            raise Exception(
+            raise AccessTokenRefreshError(
                 f'Error refreshing Access Token with status: {response.status_code}'
             )
 
-        self._credentials.access_token = response.json()['access_token']
-        self._credentials.save()
+        credentials.access_token = response.json()['access_token']
+        credentials.save()
         logger.info('Refreshed Access Token and saved to DB')
 
-    def _set_credentials(self) -> None:
-        if not self._credentials:
-            self.base_url = settings.OFFERS_SERVICE_BASE_URL
-            refresh_token = settings.OFFERS_SERVICE_REFRESH_TOKEN
-            creds, _ = OfferCredentials.objects.get_or_create(
-                refresh_token=refresh_token, defaults={'refresh_token': refresh_token}
-            )
-            self._credentials = creds
-        else:
-            self._credentials = OfferCredentials.objects.get(
-                refresh_token=self._credentials.refresh_token
-            )
-
     @staticmethod
     def _handle_response_status(
-        status_code: int, acceptable_status_code: status, error_message: str
+        status_code: int,
+        acceptable_status_code: status,
+        error_message: str,
+        product_endpoint: bool = False,
     ) -> None:
         if status_code == status.HTTP_401_UNAUTHORIZED:
             raise PermissionError("Access Token invalid")
+        # Elsewhere a 404 rather means a wrong OFFERS_SERVICE_BASE_URL
+        if status_code == status.HTTP_404_NOT_FOUND and product_endpoint:
+            raise ProductNotFoundError(error_message)
+        if status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            raise RateLimitedError(error_message)
         if status_code != acceptable_status_code:
             raise Exception(error_message)
+
+
+def _iter_json_array(byte_chunks):
+    """
+    Incrementally decodes a top-level JSON array from an iterable of byte
+    chunks, yielding its items one at a time.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(byte_chunks)
+    buffer, pos = '', 0
+    expecting = '['
+
+    def read_more(text: str, size: int):
+        # Appends chunks to `text` until it holds `size` characters (or the
+        # input ends), returns None if there was nothing more to read
+        parts, length = [text], len(text)
+        while length < size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            parts.append(text_decoder.decode(chunk))
+            length += len(parts[-1])
+        return ''.join(parts) if length > len(text) else None
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buffer):
+            buffer, pos = read_more('', 1), 0
+            if buffer is None:
+                raise ValueError('Unexpected end of JSON array')
+            continue
+
+        char = buffer[pos]
+        if expecting == '[':
+            if char != '[':
+                raise ValueError('Expected JSON array')
+            pos += 1
+            expecting = 'value or ]'
+        elif char == ']' and expecting != 'value':
+            return
+        elif expecting == ',':
+            if char != ',':
+                raise ValueError(f'Expected "," at position {pos}')
+            pos += 1
+            expecting = 'value'
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                value, end = None, None
+
+            # Value may be incomplete (or a truncated number), read more data.
+            # Doubling what is buffered before parsing again keeps values
+            # spanning many chunks from being reparsed from scratch per chunk
+            if end is None or end == len(buffer):
+                size = len(buffer) - pos
+                if size >= MAX_JSON_VALUE_SIZE:
+                    raise ValueError(f'Malformed or too large JSON value at position {pos}')
+                buffer, pos = read_more(buffer[pos:], 2 * size), 0
+                if buffer is None:
+                    raise ValueError('Unexpected end of JSON array')
+                continue
+
+            yield value
+            pos = end
+            expecting = ','
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product
+from .search import index_product, unindex_product
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, using, **kwargs):
+    index_product(instance, using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search_index(sender, instance, using, **kwargs):
+    unindex_product(instance, using)
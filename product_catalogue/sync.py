@@ -0,0 +1,398 @@
+import io
+import json
+import logging
+import tempfile
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Avg, Count, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .broadcast import OfferChanges, offer_change_event, publish_offer_changes
+from .models import Product, Offer, OfferPriceEvent
+from .profiling import profile_phase
+
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = 'product_catalogue_offer_staging'
+# Downloaded Offers are spooled to a temporary file beyond this many bytes
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+def sync_product_offers(product: Product, offer_batches) -> dict:
+    """
+    Reconciles open Offers of `product` with the Offers returned by the
+    Offers Microservice (as an iterable of Offer batches):
+     - open Offers present in the API get their price and stock updated
+     - open Offers missing from the API are Sold Out
+     - Offers not open in DB yet are (re)created
+    Every change is appended to the OfferPriceEvent log and published to
+    Offer change streams once committed (see OfferChanges).
+    Returns number of created, updated and sold out Offers.
+    """
+    changes = OfferChanges()
+    # The download finishes before the transaction starts, so its row locks
+    # aren't held while waiting on the network
+    offer_batches = _spool_offer_batches(offer_batches)
+    with transaction.atomic():
+        if settings.OFFERS_SYNC_BULK_COPY and connection.vendor == 'postgresql':
+            result = _sync_offers_copy(product, offer_batches, changes)
+        else:
+            result = _sync_offers_orm(product, offer_batches, changes)
+        if any(result.values()):
+            with profile_phase('db_write'):
+                update_offer_summaries([product.pk])
+            transaction.on_commit(
+                partial(publish_offer_changes, product.pk, changes.events), robust=True
+            )
+
+    logger.debug(
+        f'Synced Offers for Product {product}: {result["created"]} new, '
+        f'{result["updated"]} updated, {result["sold_out"]} sold out'
+    )
+    return result
+
+
+def _sync_offers_orm(product: Product, offer_batches, changes: OfferChanges) -> dict:
+    now = datetime.now(timezone.utc)
+    open_offers = product.offers.filter(items_in_stock__gt=0)
+    seen_ids = set()
+    result = {'created': 0, 'updated': 0, 'sold_out': 0}
+
+    for batch in offer_batches:
+        api_offers_by_id = {_offer_id(o['id']): o for o in batch}
+        seen_ids.update(api_offers_by_id)
+        updated_offers = []
+
+        with profile_phase('db_read'):
+            matched_offers = list(open_offers.filter(id__in=list(api_offers_by_id)))
+
+        with profile_phase('diff'):
+            for offer in matched_offers:
+                matched_offer = api_offers_by_id.pop(offer.id)
+                if (offer.price, offer.items_in_stock) != (
+                    matched_offer['price'],
+                    matched_offer['items_in_stock'],
+                ):
+                    offer.price = matched_offer['price']
+                    offer.items_in_stock = matched_offer['items_in_stock']
+                    updated_offers.append(offer)
+            new_offers = [Offer.from_json(o, product) for o in api_offers_by_id.values()]
+
+            price_events = [OfferPriceEvent.from_offer(o, now) for o in updated_offers]
+            price_events += [OfferPriceEvent.from_offer(o) for o in new_offers]
+
+        with profile_phase('db_write'):
+            Offer.objects.bulk_update(updated_offers, ['price', 'items_in_stock'])
+            Offer.objects.bulk_create(
+                new_offers,
+                update_conflicts=True,
+                unique_fields=['id'],
+                update_fields=['price', 'items_in_stock', 'product', 'created_at', 'closed_at'],
+            )
+            OfferPriceEvent.objects.bulk_create(price_events)
+        for type, offers in [('updated', updated_offers), ('created', new_offers)]:
+            for o in offers:
+                changes.add(type, o.id, o.price, o.items_in_stock)
+        result['updated'] += len(updated_offers)
+        result['created'] += len(api_offers_by_id)
+
+    with profile_phase('db_read'):
+        open_prices = list(open_offers.values_list('id', 'price'))
+    with profile_phase('diff'):
+        sold_out = [(id, price) for id, price in open_prices if id not in seen_ids]
+    with profile_phase('db_write'):
+        for i in range(0, len(sold_out), settings.OFFERS_SYNC_BATCH_SIZE):
+            batch = sold_out[i:i + settings.OFFERS_SYNC_BATCH_SIZE]
+            result['sold_out'] += Offer.objects.filter(
+                id__in=[id for id, _ in batch]
+            ).update(items_in_stock=0, closed_at=now)
+            OfferPriceEvent.objects.bulk_create(
+                OfferPriceEvent(
+                    offer_id=id, product_id=product.pk, created_at=now, price=price, items_in_stock=0
+                )
+                for id, price in batch
+            )
+        for id, price in sold_out:
+            changes.add('sold_out', id, price, 0)
+
+    return result
+
+
+def _sync_offers_copy(product: Product, offer_batches, changes: OfferChanges) -> dict:
+    """
+    Postgres only: COPYs the API payload batch by batch into a temporary
+    staging table and reconciles it with a few set-based statements instead
+    of per-row writes.
+    """
+    now = datetime.now(timezone.utc)
+    offer_table = Offer._meta.db_table
+    # Only as many changed rows are returned as can be published one by one
+    event_limit = settings.OFFER_STREAM_MAX_EVENTS + 1
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} ('
+            'id uuid NOT NULL, price integer NOT NULL, items_in_stock integer NOT NULL'
+            ') ON COMMIT DELETE ROWS'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {STAGING_TABLE}_id ON {STAGING_TABLE} (id)'
+        )
+        # Left over when syncing several Products in one outer transaction
+        cursor.execute(f'TRUNCATE {STAGING_TABLE}')
+        for batch in offer_batches:
+            with profile_phase('db_write'):
+                cursor.copy_expert(
+                    f'COPY {STAGING_TABLE} (id, price, items_in_stock) FROM STDIN',
+                    _copy_buffer(batch),
+                )
+
+        # Diffing happens inside these statements, so it is all accounted as writes
+        with profile_phase('db_write'):
+            # Offers repeated across batches: the last occurrence wins
+            cursor.execute(
+                f'DELETE FROM {STAGING_TABLE} a USING {STAGING_TABLE} b '
+                'WHERE a.id = b.id AND a.ctid < b.ctid'
+            )
+
+            # Every statement appends the Offers it changed to the price event log
+            cursor.execute(
+                f'WITH changed AS (INSERT INTO {offer_table} '
+                '(id, price, items_in_stock, product_id, created_at, closed_at) '
+                'SELECT s.id, s.price, s.items_in_stock, %s, %s, NULL '
+                f'FROM {STAGING_TABLE} s WHERE NOT EXISTS ('
+                f'SELECT 1 FROM {offer_table} o '
+                'WHERE o.id = s.id AND o.product_id = %s AND o.items_in_stock > 0'
+                ') ON CONFLICT (id) DO UPDATE SET '
+                'price = EXCLUDED.price, items_in_stock = EXCLUDED.items_in_stock, '
+                'product_id = EXCLUDED.product_id, created_at = EXCLUDED.created_at, '
+                'closed_at = NULL '
+                'RETURNING id, price, items_in_stock) '
+                + _insert_price_events_sql(),
+                [product.pk, now, product.pk, product.pk, now, event_limit],
+            )
+            created = _add_changes(changes, 'created', cursor.fetchall())
+
+            cursor.execute(
+                f'WITH changed AS (UPDATE {offer_table} o SET items_in_stock = 0, closed_at = %s '
+                'WHERE o.product_id = %s AND o.items_in_stock > 0 AND NOT EXISTS ('
+                f'SELECT 1 FROM {STAGING_TABLE} s WHERE s.id = o.id) '
+                'RETURNING o.id, o.price, o.items_in_stock) '
+                + _insert_price_events_sql(),
+                [now, product.pk, product.pk, now, event_limit],
+            )
+            sold_out = _add_changes(changes, 'sold_out', cursor.fetchall())
+
+            cursor.execute(
+                f'WITH changed AS (UPDATE {offer_table} o '
+                'SET price = s.price, items_in_stock = s.items_in_stock '
+                f'FROM {STAGING_TABLE} s '
+                'WHERE o.id = s.id AND o.product_id = %s AND o.items_in_stock > 0 '
+                'AND (o.price <> s.price OR o.items_in_stock <> s.items_in_stock) '
+                'RETURNING o.id, o.price, o.items_in_stock) '
+                + _insert_price_events_sql(),
+                [product.pk, product.pk, now, event_limit],
+            )
+            updated = _add_changes(changes, 'updated', cursor.fetchall())
+
+    return {'created': created, 'updated': updated, 'sold_out': sold_out}
+
+
+def apply_offer_events(events: [dict]) -> dict:
+    """
+    Applies incremental Offer changes pushed by the Offers Microservice with
+    the same semantics as `sync_product_offers`. Events of unknown Products
+    are ignored.
+    """
+    now = datetime.now(timezone.utc)
+    result = {'created': 0, 'updated': 0, 'sold_out': 0}
+    price_events = []
+    changes = defaultdict(list)
+    product_ids = set(
+        Product.objects.filter(
+            id__in={event['product_id'] for event in events}
+        ).values_list('id', flat=True)
+    )
+
+    with transaction.atomic():
+        offers = Offer.objects.select_for_update().in_bulk(
+            [event['offer']['id'] for event in events]
+        )
+        for event in events:
+            if event['product_id'] not in product_ids:
+                logger.debug(f'Ignoring Offer event of unknown Product: {event}')
+                continue
+
+            offer_data = event['offer']
+            offer = offers.get(offer_data['id'])
+            is_open = (
+                offer is not None
+                and offer.product_id == event['product_id']
+                and offer.items_in_stock > 0
+            )
+
+            if event['type'] == 'sold_out':
+                if is_open:
+                    offer.items_in_stock = 0
+                    offer.closed_at = now
+                    offer.save(update_fields=['items_in_stock', 'closed_at'])
+                    price_events.append(OfferPriceEvent.from_offer(offer, now))
+                    changes[offer.product_id].append(
+                        offer_change_event('sold_out', offer.id, offer.price, 0)
+                    )
+                    result['sold_out'] += 1
+            elif is_open:
+                if (offer.price, offer.items_in_stock) != (
+                    offer_data['price'],
+                    offer_data['items_in_stock'],
+                ):
+                    offer.price = offer_data['price']
+                    offer.items_in_stock = offer_data['items_in_stock']
+                    offer.save(update_fields=['price', 'items_in_stock'])
+                    price_events.append(OfferPriceEvent.from_offer(offer, now))
+                    changes[offer.product_id].append(
+                        offer_change_event('updated', offer.id, offer.price, offer.items_in_stock)
+                    )
+                    result['updated'] += 1
+            else:
+                offer = Offer(
+                    id=offer_data['id'],
+                    price=offer_data['price'],
+                    items_in_stock=offer_data['items_in_stock'],
+                    product_id=event['product_id'],
+                )
+                offer.save()
+                offers[offer.id] = offer
+                price_events.append(OfferPriceEvent.from_offer(offer))
+                changes[offer.product_id].append(
+                    offer_change_event('created', offer.id, offer.price, offer.items_in_stock)
+                )
+                result['created'] += 1
+
+        OfferPriceEvent.objects.bulk_create(price_events)
+        update_offer_summaries(product_ids)
+        for product_id, product_changes in changes.items():
+            transaction.on_commit(
+                partial(publish_offer_changes, product_id, product_changes), robust=True
+            )
+
+    logger.debug(
+        f'Applied {len(events)} Offer events: {result["created"]} new, '
+        f'{result["updated"]} updated, {result["sold_out"]} sold out'
+    )
+    return result
+
+
+def close_offers(offer_ids) -> int:
+    """
+    Marks the given open Offers Sold Out (like the sync does for Offers gone
+    from the Offers Microservice), e.g. to take them off the market by hand.
+    Returns number of closed Offers.
+    """
+    now = datetime.now(timezone.utc)
+    changes = defaultdict(list)
+
+    with transaction.atomic():
+        offers = list(
+            Offer.objects.select_for_update()
+            .filter(id__in=offer_ids, items_in_stock__gt=0)
+            .only('id', 'product_id', 'price')
+        )
+        Offer.objects.filter(id__in=[offer.id for offer in offers]).update(
+            items_in_stock=0, closed_at=now
+        )
+        for offer in offers:
+            offer.items_in_stock = 0
+            changes[offer.product_id].append(offer_change_event('sold_out', offer.id, offer.price, 0))
+        OfferPriceEvent.objects.bulk_create(OfferPriceEvent.from_offer(o, now) for o in offers)
+        update_offer_summaries(list(changes))
+        for product_id, product_changes in changes.items():
+            transaction.on_commit(
+                partial(publish_offer_changes, product_id, product_changes), robust=True
+            )
+
+    return len(offers)
+
+
+def update_offer_summaries(product_ids) -> None:
+    """
+    Recalculates best / average price, open Offer count and total stock of
+    the given Products from their open Offers.
+    """
+    open_offers = Offer.objects.filter(
+        product=OuterRef('pk'), items_in_stock__gt=0
+    ).values('product')
+    Product.objects.filter(pk__in=product_ids).update(
+        best_price=Subquery(open_offers.annotate(v=Min('price')).values('v')),
+        avg_price=Subquery(open_offers.annotate(v=Avg('price')).values('v')),
+        open_offer_count=Coalesce(
+            Subquery(open_offers.annotate(v=Count('id')).values('v')), 0
+        ),
+        total_stock=Coalesce(
+            Subquery(open_offers.annotate(v=Sum('items_in_stock')).values('v')), 0
+        ),
+    )
+
+
+def _spool_offer_batches(offer_batches):
+    """
+    Consumes all Offer batches into a temporary file (kept in memory while
+    small) and returns an iterator replaying them batch by batch.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode='w+')
+    try:
+        for batch in offer_batches:
+            spool.write(json.dumps(batch, default=str) + '\n')
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return _iter_spooled_batches(spool)
+
+
+def _iter_spooled_batches(spool):
+    with spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def _insert_price_events_sql() -> str:
+    # Appends rows of a `changed` (id, price, items_in_stock) CTE, taking
+    # product ID and timestamp as parameters, and returns up to a limit (the
+    # last parameter) of them along with the number of all of them. The
+    # CTEs run to completion whatever the limit
+    return (
+        f', logged AS (INSERT INTO {OfferPriceEvent._meta.db_table} '
+        '(offer_id, product_id, created_at, price, items_in_stock) '
+        'SELECT id, %s, %s, price, items_in_stock FROM changed '
+        'RETURNING offer_id, price, items_in_stock) '
+        'SELECT offer_id, price, items_in_stock, count(*) OVER () FROM logged LIMIT %s'
+    )
+
+
+def _add_changes(changes: OfferChanges, type: str, rows) -> int:
+    # Takes rows of `_insert_price_events_sql`, returns the number of changes
+    for offer_id, price, items_in_stock, _ in rows:
+        changes.add(type, offer_id, price, items_in_stock)
+    return rows[0][3] if rows else 0
+
+
+def _copy_buffer(api_offers: [dict]) -> io.StringIO:
+    # Values are validated as UUIDs/ints, so nothing can break the COPY text format
+    rows = {
+        _offer_id(o['id']): (int(o['price']), int(o['items_in_stock']))
+        for o in api_offers
+    }
+    return io.StringIO(
+        ''.join(f'{id}\t{price}\t{stock}\n' for id, (price, stock) in rows.items())
+    )
+
+
+def _offer_id(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
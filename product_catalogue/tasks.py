@@ -1,44 +1,155 @@
 from celery import shared_task
-import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from django.conf import settings
+from django.db import connections
 from datetime import datetime, timezone
+import json
+import logging
+import threading
 
-from .models import Product, Offer
-from .services import OffersService
+from .deadlines import deadline, deadline_exceeded
+from .deletion import purge_deleted_products
+from .models import ProductSyncState
+from .profiling import SyncProfiler, profile_iter, profile_phase, profile_product
+from .scheduling import (
+    claim_sync_states,
+    get_sync_states,
+    iter_due_sync_states,
+    release_sync_states,
+    reschedule,
+)
+from .credentials import NoCredentialsAvailable
+from .services import RateLimitedError, get_offers_service
+from .sync import sync_product_offers
 
 
-offers_service = OffersService()
 logger = logging.getLogger(__name__)
 
+# The Offers Microservice can't be called for now, which isn't the fault of the Products
+UPSTREAM_UNAVAILABLE_ERRORS = (NoCredentialsAvailable, RateLimitedError)
+
 
 @shared_task
 def fetch_offers_task() -> None:
     logging.info(f'Starting Task {fetch_offers_task.__name__}')
-    for product in Product.objects.all():
-        try:
-            available_offers_db = product.offers.filter(items_in_stock__gt=0)
-            available_offers_api = offers_service.get_product_offers(product.id)
-
-            is_new_offer = False if available_offers_db.exists() else True
-            for offer in available_offers_db:
-                matched_offer = next(
-                    (o for o in available_offers_api if o['id'] == str(offer.id)), None
+    profiler = SyncProfiler.from_settings()
+    sync_offers_cycle(profiler)
+
+    if profiler.enabled:
+        logger.info(f'Offers sync cycle profile: {json.dumps(profiler.report())}')
+
+
+def sync_offers_cycle(profiler: SyncProfiler) -> None:
+    now = datetime.now(timezone.utc)
+    synced = 0
+
+    with profiler, deadline(settings.OFFERS_SYNC_CYCLE_DEADLINE or None):
+        # Due Products are streamed in chunks, so memory doesn't grow with their count
+        for states in iter_due_sync_states(now):
+            try:
+                synced += sync_products(claim_sync_states(states, now), now)
+            except UPSTREAM_UNAVAILABLE_ERRORS as e:
+                logging.warning(
+                    f'Offers Microservice unavailable ({e}), leaving the rest for the next cycle'
+                )
+                break
+            if deadline_exceeded():
+                logging.warning(
+                    'Offers sync cycle ran out of time, leaving the rest for the next one'
                 )
-                if matched_offer:
-                    offer.price = matched_offer['price']
-                    offer.items_in_stock = matched_offer['items_in_stock']
-                    logging.debug(f'Updated Offer {offer}')
-                else:
-                    offer.items_in_stock = 0
-                    is_new_offer = True
-                    offer.closed_at = datetime.now(timezone.utc)
-                    logging.debug(f'Offer {offer} Sold Out')
-                offer.save()
-
-            if is_new_offer:
-                for offer in available_offers_api:
-                    if offer['id'] not in (str(o.id) for o in available_offers_db):
-                        new_offer = Offer.from_json(offer, product)
-                        new_offer.save()
-                        logging.debug(f'Saved new Offer {offer}')
-        except Exception as e:
-            logging.error(f'Unable to get new Offers for Product {product}:\n{e}')
+                break
+
+    logging.info(f'Synced {synced} Products')
+
+
+@shared_task
+def sync_products_task(product_ids: [str]) -> None:
+    """
+    Syncs the given Products right away, whether due, in backoff or dead
+    lettered. Products another sync is working on are left to it.
+    """
+    now = datetime.now(timezone.utc)
+    states = claim_sync_states(get_sync_states(product_ids), now)
+    with deadline(settings.OFFERS_SYNC_CYCLE_DEADLINE or None):
+        synced = sync_products(states, now)
+    logging.info(f'Synced {synced} of {len(states)} Products')
+
+
+def sync_products(states: [ProductSyncState], now: datetime) -> int:
+    """
+    Syncs the Products of claimed `states` in up to OFFERS_SYNC_CONCURRENCY
+    threads until the time budget runs out and reschedules those it got to,
+    returning their count. The rest are released, still due, and errors of
+    UPSTREAM_UNAVAILABLE_ERRORS are raised once the chunk stopped.
+    """
+    changes = {}
+    failures = {}
+    unavailable = []
+    offers_service = get_offers_service()
+    pending = iter(states)
+    lock = threading.Lock()
+
+    def sync_pending_products():
+        while not deadline_exceeded() and not unavailable:
+            with lock:
+                state = next(pending, None)
+            if state is None:
+                return
+            product = state.product
+            try:
+                with profile_product(product), deadline(
+                    settings.OFFERS_SYNC_PRODUCT_DEADLINE or None
+                ):
+                    with profile_phase('fetch'):
+                        if settings.OFFERS_SYNC_STREAMING:
+                            offer_batches = offers_service.iter_product_offers(product.id)
+                        else:
+                            offer_batches = [offers_service.get_product_offers(product.id)]
+                    result = sync_product_offers(product, profile_iter('fetch', offer_batches))
+                changes[product.id] = sum(result.values())
+            except UPSTREAM_UNAVAILABLE_ERRORS as e:
+                # Like running out of time, the Product stays due with the rest of the chunk
+                unavailable.append(e)
+                return
+            except Exception as e:
+                if deadline_exceeded():
+                    # Cut short by the budget of the whole cycle, not a failure of the Product
+                    return
+                logging.error(f'Unable to get new Offers for Product {product}:\n{e}')
+                failures[product.id] = e
+
+    concurrency = min(settings.OFFERS_SYNC_CONCURRENCY, len(states))
+    if concurrency <= 1:
+        sync_pending_products()
+    else:
+        # Each thread gets its own copy of the time budget and profiler context
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = [
+                executor.submit(copy_context().run, _run_in_thread, sync_pending_products)
+                for _ in range(concurrency)
+            ]
+            for future in futures:
+                future.result()
+
+    synced_ids = changes.keys() | failures.keys()
+    synced_states = [state for state in states if state.product_id in synced_ids]
+    reschedule(synced_states, changes, now, failures)
+    release_sync_states([state for state in states if state.product_id not in synced_ids])
+    if unavailable:
+        raise unavailable[0]
+    return len(synced_states)
+
+
+def _run_in_thread(func) -> None:
+    try:
+        func()
+    finally:
+        # Database connections are per thread and would be left open otherwise
+        connections.close_all()
+
+
+@shared_task
+def purge_deleted_products_task(product_ids: [str] = None) -> None:
+    purged = purge_deleted_products(product_ids)
+    logger.info(f'Purged {purged} deleted Products')
@@ -1,14 +1,81 @@
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
 import pytest
 from django.urls import reverse
+from django.core.management import call_command
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models import F, Q
 from unittest.mock import patch
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 from uuid import uuid4
 
-from product_catalogue.tasks import fetch_offers_task
-from product_catalogue.models import Product, Offer, User
-from product_catalogue.serializers import OfferSerializer
+from marketplace import celery_app
+from marketplace.db_router import (
+    ReplicaRouter,
+    _query_replica_lag,
+    read_from_replica,
+    is_pinned_to_primary,
+)
+from product_catalogue.tasks import (
+    fetch_offers_task,
+    purge_deleted_products_task,
+    sync_products_task,
+)
+from product_catalogue.credentials import CredentialPool, NoCredentialsAvailable
+from product_catalogue.deadlines import DeadlineExceeded, deadline, get_remaining
+from product_catalogue.sync import sync_product_offers, update_offer_summaries
+from product_catalogue.services import (
+    OffersService,
+    ProductNotFoundError,
+    RateLimitedError,
+    get_offers_service,
+    _iter_json_array,
+)
+from product_catalogue.models import (
+    Product,
+    Offer,
+    OfferPriceEvent,
+    User,
+    OfferCredentials,
+    ProductSyncState,
+)
+from product_catalogue import scheduling
+from product_catalogue.scheduling import (
+    claim_sync_states,
+    flush_product_reads,
+    get_due_sync_states,
+    get_sync_states,
+    iter_due_sync_states,
+    release_sync_states,
+    reschedule,
+    record_product_read,
+)
+from product_catalogue.serializers import (
+    OfferSerializer,
+    ProductSerializer,
+    OfferValuesSerializer,
+    ProductValuesSerializer,
+)
+from rest_framework.renderers import JSONRenderer
+from product_catalogue.renderers import FastJSONRenderer
+from product_catalogue.parsers import FastJSONParser
+from product_catalogue.throttling import WindowRateThrottle
+from product_catalogue.broadcast import InMemoryBroker
+from django.conf import settings
+from django.contrib.auth.models import Permission
+import gzip
+import hashlib
+import hmac
+import threading
+import time
+import httpx
+import io
+import json
+import subprocess
+import sys
 
 
 @pytest.fixture
@@ -18,7 +85,18 @@ def user():
     return user
 
 
-@patch("product_catalogue.services.OffersService")
+@pytest.fixture(autouse=True)
+def discard_product_reads():
+    # Reads buffered by a test would otherwise be flushed into later tests or at exit
+    yield
+    with scheduling._pending_reads_lock:
+        scheduling._pending_reads.clear()
+        if scheduling._flush_timer is not None:
+            scheduling._flush_timer.cancel()
+            scheduling._flush_timer = None
+
+
+@patch("product_catalogue.services.OffersService.register_product_for_offers")
 @pytest.mark.django_db
 def test_create_product(mock_register_product_for_offers, user):
     url = reverse('product-list')
@@ -48,6 +126,113 @@ def test_create_product_error(user):
         assert Product.objects.count() == 0
 
 
+@override_settings(REQUEST_DEADLINE=5)
+@pytest.mark.django_db
+def test_create_product_deadline_exceeded(user):
+    def register_product_for_offers(product_data):
+        assert 0 < get_remaining() <= 5
+        raise DeadlineExceeded()
+
+    with patch(
+        'product_catalogue.services.OffersService.register_product_for_offers',
+        side_effect=register_product_for_offers,
+    ):
+        url = reverse('product-list')
+        data = {'name': 'Test Product', 'description': 'Test Description'}
+
+        response = _send_post_request_auth(url, data, user)
+        assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+        assert Product.objects.count() == 0
+    assert get_remaining() is None
+
+
+@pytest.mark.django_db
+def test_create_product_idempotency_key(user):
+    url = reverse('product-list')
+    data = {'name': 'Test Product', 'description': 'Test Description'}
+    client = APIClient()
+    headers = {**_get_access_token_header(user), 'Idempotency-Key': str(uuid4())}
+
+    with patch(
+        'product_catalogue.services.OffersService.register_product_for_offers',
+        side_effect=[Exception(), None],
+    ) as register_product_for_offers:
+        response = client.post(url, data, format='json', headers=headers)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+        response = client.post(url, data, format='json', headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        replayed = client.post(url, data, format='json', headers=headers)
+        assert replayed.status_code == status.HTTP_201_CREATED
+        assert replayed['Idempotent-Replayed'] == 'true'
+        assert replayed.json() == response.json()
+
+        response = client.post(
+            url, {**data, 'name': 'Other Product'}, format='json', headers=headers
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    assert register_product_for_offers.call_count == 2
+    assert Product.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_product_offers_rate_limit(user):
+    product = _create_test_product()
+    other_user = User.objects.create(email='otheruser@gmail.com', access_token=uuid4())
+    url = reverse('product-detail', args=[product.id])
+    rest_framework_settings = {
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'user': '100/min', 'product_offers': '2/min'},
+    }
+
+    with override_settings(REST_FRAMEWORK=rest_framework_settings), patch.object(
+        WindowRateThrottle, 'timer', return_value=1000.0
+    ) as timer:
+        for _ in range(2):
+            response = _send_get_request_auth(f'{url}?includeOffers=true', user)
+            assert response.status_code == status.HTTP_200_OK
+
+        response = _send_get_request_auth(f'{url}?includeOffers=true', user)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        # Until the next minute
+        assert response['Retry-After'] == '20'
+        assert _send_get_request_auth(url, user).status_code == status.HTTP_200_OK
+        response = _send_get_request_auth(f'{url}?includeOffers=true', other_user)
+        assert response.status_code == status.HTTP_200_OK
+
+        timer.return_value += 30
+        response = _send_get_request_auth(f'{url}?includeOffers=true', user)
+        assert response.status_code == status.HTTP_200_OK
+
+
+def test_rate_limit_concurrent():
+    request = APIRequestFactory().get('/', HTTP_ACCESS_TOKEN=str(uuid4()))
+    view = SimpleNamespace(throttle_scope='product_offers')
+    rest_framework_settings = {
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'user': '100/min', 'product_offers': '5/min'},
+    }
+    barrier = threading.Barrier(20, timeout=5)
+    allowed = []
+
+    def send_request():
+        barrier.wait()
+        allowed.append(WindowRateThrottle().allow_request(request, view))
+
+    with override_settings(REST_FRAMEWORK=rest_framework_settings), patch.object(
+        WindowRateThrottle, 'timer', return_value=2000.0
+    ), patch.object(WindowRateThrottle, 'cache', _SlowCache(WindowRateThrottle.cache)):
+        threads = [threading.Thread(target=send_request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # Concurrent requests never get past the limit
+    assert allowed.count(True) == 5
+
+
 @pytest.mark.django_db
 def test_retrieve_product_without_offers(user):
     product = _create_test_product()
@@ -84,6 +269,51 @@ def test_list_product(user):
     assert len(response.data) == 4
 
 
+@pytest.mark.django_db
+def test_search_products(user):
+    Product.objects.create(name='Red Bicycle', description='Fast road bike')
+    Product.objects.create(name='Blue Bicycle', description='Bicycle for kids')
+    Product.objects.create(name='Red Car', description='Fast car')
+    Product.objects.create(name='Kettle', description='Boils water')
+    url = reverse('product-list')
+
+    response = _send_get_request_auth(f'{url}?search=bicy', user)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['count'] == 2
+    assert response.data['results'][0]['name'] == 'Blue Bicycle'
+
+    response = _send_get_request_auth(f'{url}?search=red%20fast&limit=1', user)
+    assert response.data['count'] == 2
+    assert len(response.data['results']) == 1
+
+    response = _send_get_request_auth(f'{url}?search=kettle', user)
+    assert [p['name'] for p in response.data['results']] == ['Kettle']
+
+    # List params don't apply to a single Product
+    kettle = Product.objects.get(name='Kettle')
+    detail_url = reverse('product-detail', kwargs={'pk': kettle.id})
+    for params in ['search=nomatch', 'ordering=bogus', 'price_min=1']:
+        response = _send_get_request_auth(f'{detail_url}?{params}', user)
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_search_products_index_follows_updates(user):
+    product = Product.objects.create(name='Kettle', description='Boils water')
+    product.name = 'Toaster'
+    product.save()
+    url = reverse('product-list')
+
+    response = _send_get_request_auth(f'{url}?search=kettle', user)
+    assert response.data['count'] == 0
+    response = _send_get_request_auth(f'{url}?search=toast', user)
+    assert response.data['count'] == 1
+
+    product.delete()
+    response = _send_get_request_auth(f'{url}?search=toast', user)
+    assert response.data['count'] == 0
+
+
 @pytest.mark.django_db
 def test_update_product(user):
     product = _create_test_product()
@@ -108,11 +338,38 @@ def test_delete_product(user):
 
     headers = _get_access_token_header(user)
     response = client.delete(url, headers=headers)
-    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert response.status_code == status.HTTP_202_ACCEPTED
 
     assert Product.objects.count() == 0
 
 
+@pytest.mark.django_db
+def test_bulk_delete_products(user, django_capture_on_commit_callbacks):
+    products = [_create_test_product() for _ in range(3)]
+    for product in products:
+        OfferPriceEvent.objects.bulk_create(
+            OfferPriceEvent.from_offer(offer) for offer in _create_test_offers(product)
+        )
+    url = reverse('product-bulk-delete')
+    data = {'ids': [str(products[0].id), str(products[1].id), str(uuid4())]}
+
+    with patch(
+        'product_catalogue.tasks.purge_deleted_products_task.delay'
+    ) as purge_task, django_capture_on_commit_callbacks(execute=True):
+        response = _send_post_request_auth(url, data, user)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert sorted(response.data['ids']) == sorted(data['ids'][:2])
+    assert list(Product.objects.all()) == [products[2]]
+    response = _send_get_request_auth(reverse('offer-list'), user)
+    assert {offer['product'] for offer in response.data} == {products[2].id}
+
+    with override_settings(PRODUCT_PURGE_BATCH_SIZE=2):
+        purge_deleted_products_task(*purge_task.call_args.args)
+    assert Product.all_objects.count() == 1
+    assert Offer.objects.count() == 5
+    assert OfferPriceEvent.objects.count() == 5
+
+
 @pytest.mark.django_db
 def test_retrieve_offer(user):
     product = _create_test_product()
@@ -138,9 +395,96 @@ def test_list_offers(user):
     assert len(response.data) == offer_count
 
 
-@patch('product_catalogue.tasks.offers_service.get_product_offers')
 @pytest.mark.django_db
-def test_fetch_offers_task(mock_get_product_offers):
+def test_values_serializers_match_model_serializers():
+    product = _create_test_product()
+    _create_test_offers(product)
+    renderer = JSONRenderer()
+
+    for serializer, values_serializer, queryset in [
+        (ProductSerializer, ProductValuesSerializer, Product.objects.all()),
+        (OfferSerializer, OfferValuesSerializer, Offer.objects.all()),
+    ]:
+        expected = renderer.render(serializer(queryset, many=True).data)
+        rows = values_serializer.values_list(queryset)
+        assert renderer.render(values_serializer(rows).data) == expected
+
+
+@pytest.mark.django_db
+def test_filter_offers(user):
+    product = _create_test_product()
+    other_product = _create_test_product()
+    offers = _create_test_offers(product)
+    _create_test_offers(other_product)
+    closed_offer = _create_closed_offer(product, _str_to_datetime('10.04.2020'), 700)
+    url = reverse('offer-list')
+
+    def filtered_ids(query):
+        response = _send_get_request_auth(f'{url}?{query}', user)
+        assert response.status_code == status.HTTP_200_OK
+        return {str(offer['id']) for offer in response.data['results']}
+
+    assert len(filtered_ids(f'product={product.id}')) == 6
+    assert filtered_ids(f'product={product.id}&price_min=1000&price_max=2000') == {
+        str(o.id) for o in offers[1:4]
+    }
+    assert filtered_ids(f'product={product.id}&in_stock=true&price_max=1000') == {
+        str(offers[1].id)
+    }
+    assert filtered_ids(f'product={product.id}&open=false') == {str(closed_offer.id)}
+    assert filtered_ids('closed_before=2020-04-11') == {str(closed_offer.id)}
+    assert len(filtered_ids(f'product={product.id}&created_after=2021-01-01')) == 5
+
+
+@pytest.mark.django_db
+def test_filter_offers_invalid_value(user):
+    url = reverse('offer-list')
+
+    response = _send_get_request_auth(f'{url}?price_min=cheap&product=1', user)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert set(response.data) == {'price_min', 'product'}
+
+
+@pytest.mark.django_db
+def test_list_offers_cursor_pagination(user):
+    product = _create_test_product()
+    offers = _create_test_offers(product, 5)
+    url = reverse('offer-list')
+
+    response = _send_get_request_auth(f'{url}?product={product.id}&limit=2', user)
+    seen_ids = [str(offer['id']) for offer in response.data['results']]
+    while response.data['next']:
+        response = _send_get_request_auth(response.data['next'], user)
+        seen_ids += [str(offer['id']) for offer in response.data['results']]
+
+    assert sorted(seen_ids) == sorted(str(o.id) for o in offers)
+
+
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_profile_sync_command(mock_iter_product_offers):
+    products = [_create_test_product() for _ in range(3)]
+    _create_test_offers(products[0])
+    mock_iter_product_offers.side_effect = lambda product_id: iter(
+        [[{'id': str(uuid4()), 'price': 100, 'items_in_stock': 1}]]
+    )
+
+    stdout = io.StringIO()
+    call_command('profile_sync', '--json', '--top=2', '--cprofile', stdout=stdout)
+    report = json.loads(stdout.getvalue())
+
+    assert report['products'] == 3
+    assert report['errors'] == 0
+    assert set(report['phases']) == {'fetch', 'db_read', 'diff', 'db_write'}
+    assert report['phases']['db_write'] > 0
+    assert len(report['slowest_products']) == 2
+    assert report['slowest_products'][0]['total'] >= report['slowest_products'][1]['total']
+    assert 'sync_product_offers' in report['cprofile']
+
+
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_fetch_offers_task(mock_iter_product_offers):
     product = _create_test_product()
     offers = _create_test_offers(product)
 
@@ -155,7 +499,7 @@ def test_fetch_offers_task(mock_get_product_offers):
     serializer = OfferSerializer(offers_from_api, many=True)
     offers_from_api = serializer.data
     offers_from_api[0]['price'] += 20
-    mock_get_product_offers.return_value = offers_from_api
+    mock_iter_product_offers.return_value = iter([offers_from_api])
 
     fetch_offers_task()
     new_offers = Offer.objects.all()
@@ -165,6 +509,791 @@ def test_fetch_offers_task(mock_get_product_offers):
     assert new_offers.get(id=offers[1].id).closed_at is not None
 
 
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_fetch_offers_task_skips_products_not_due(mock_iter_product_offers):
+    due_product = _create_test_product()
+    product = _create_test_product()
+    ProductSyncState.objects.create(
+        product=product, next_sync_at=datetime.now(timezone.utc) + timedelta(hours=1)
+    )
+    mock_iter_product_offers.return_value = iter([[]])
+
+    fetch_offers_task()
+    mock_iter_product_offers.assert_called_once_with(due_product.id)
+    assert due_product.sync_state.last_synced_at is not None
+    assert due_product.sync_state.next_sync_at > datetime.now(timezone.utc)
+
+
+@override_settings(OFFERS_SYNC_CHUNK_SIZE=2)
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_fetch_offers_task_in_chunks(mock_iter_product_offers):
+    products = [_create_test_product() for _ in range(5)]
+    mock_iter_product_offers.side_effect = lambda product_id: iter([[]])
+
+    with override_settings(OFFERS_SYNC_BUDGET=3):
+        assert [len(chunk) for chunk in iter_due_sync_states(datetime.now(timezone.utc))] == [2, 1]
+    fetch_offers_task()
+    synced_ids = [call.args[0] for call in mock_iter_product_offers.call_args_list]
+    assert sorted(synced_ids) == sorted(product.id for product in products)
+    assert ProductSyncState.objects.filter(last_synced_at__isnull=True).count() == 0
+
+    if connection.vendor == 'postgresql':
+        # The keyset of the next chunk is an index range, not a scan of earlier chunks
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+        state = ProductSyncState.objects.order_by('next_sync_at', 'product_id').first()
+        plan = (
+            ProductSyncState.objects.filter(
+                Q(next_sync_at__gt=state.next_sync_at)
+                | Q(next_sync_at=state.next_sync_at, product_id__gt=state.product_id)
+            )
+            .order_by('next_sync_at', 'product_id')
+            .explain()
+        )
+        assert 'sync_state_next_sync_idx' in plan
+
+
+@override_settings(OFFERS_SYNC_CYCLE_DEADLINE=0.05)
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_fetch_offers_task_cycle_deadline(mock_iter_product_offers):
+    for _ in range(3):
+        _create_test_product()
+
+    def iter_product_offers(product_id):
+        time.sleep(0.1)
+        return iter([[]])
+
+    mock_iter_product_offers.side_effect = iter_product_offers
+    fetch_offers_task()
+
+    # Products left once the budget ran out stay due, without counting as failed
+    assert mock_iter_product_offers.call_count == 1
+    assert ProductSyncState.objects.filter(last_synced_at__isnull=False).count() == 1
+    assert ProductSyncState.objects.filter(failure_count__gt=0).count() == 0
+    assert len(get_due_sync_states(datetime.now(timezone.utc))) == 2
+
+
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_fetch_offers_task_upstream_unavailable(mock_iter_product_offers):
+    for _ in range(3):
+        _create_test_product()
+
+    for error in [RateLimitedError('Rate limited'), NoCredentialsAvailable('No credentials')]:
+        mock_iter_product_offers.reset_mock()
+        mock_iter_product_offers.side_effect = error
+        fetch_offers_task()
+
+        # The cycle stops and no Product is held responsible
+        assert mock_iter_product_offers.call_count == 1
+        assert ProductSyncState.objects.filter(failure_count__gt=0).count() == 0
+        assert len(get_due_sync_states(datetime.now(timezone.utc))) == 3
+
+
+@override_settings(OFFERS_SYNC_CONCURRENCY=3)
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db(transaction=True)
+def test_fetch_offers_task_in_parallel(mock_iter_product_offers):
+    products = [_create_test_product() for _ in range(6)]
+    # Only passes once 3 Products are being synced at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    def iter_product_offers(product_id):
+        barrier.wait()
+        return iter([[]])
+
+    mock_iter_product_offers.side_effect = iter_product_offers
+    fetch_offers_task()
+
+    synced_ids = [call.args[0] for call in mock_iter_product_offers.call_args_list]
+    assert sorted(synced_ids) == sorted(product.id for product in products)
+    assert ProductSyncState.objects.filter(last_synced_at__isnull=False).count() == 6
+    assert ProductSyncState.objects.filter(failure_count__gt=0).count() == 0
+
+
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_fetch_offers_task_failure_backoff(mock_iter_product_offers, admin_client):
+    failing, missing = _create_test_product(), _create_test_product()
+    errors = {failing.id: Exception('Timeout'), missing.id: ProductNotFoundError('Not found')}
+
+    def iter_product_offers(product_id):
+        raise errors[product_id]
+
+    mock_iter_product_offers.side_effect = iter_product_offers
+    fetch_offers_task()
+
+    now = datetime.now(timezone.utc)
+    failing_state, missing_state = failing.sync_state, missing.sync_state
+    failing_state.refresh_from_db()
+    missing_state.refresh_from_db()
+    assert failing_state.failure_count == 1
+    assert failing_state.last_error == 'Exception: Timeout'
+    assert failing_state.dead_lettered_at is None
+    assert failing_state.next_sync_at > now + timedelta(seconds=settings.FETCH_OFFERS_INTERVAL / 2)
+    # A single 404 is retried like other failures
+    assert missing_state.not_found_count == 1
+    assert missing_state.dead_lettered_at is None
+    assert len(get_due_sync_states(now + timedelta(days=1))) == 2
+
+    ProductSyncState.objects.update(next_sync_at=now)
+    with override_settings(OFFERS_SYNC_NOT_FOUND_FAILURES=2):
+        fetch_offers_task()
+    assert get_due_sync_states(now + timedelta(days=1)) == [failing_state]
+
+    ProductSyncState.objects.update(next_sync_at=now)
+    with override_settings(OFFERS_SYNC_MAX_FAILURES=3):
+        fetch_offers_task()
+    assert get_due_sync_states(now + timedelta(days=1)) == []
+
+    response = admin_client.post(
+        '/admin/product_catalogue/productsyncstate/',
+        {'action': 'requeue', '_selected_action': [str(failing.id)]},
+    )
+    assert response.status_code == status.HTTP_302_FOUND
+    assert get_due_sync_states(datetime.now(timezone.utc)) == [failing_state]
+    assert mock_iter_product_offers.call_count == 5
+
+
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_sync_states_claimed(mock_iter_product_offers):
+    products = [_create_test_product() for _ in range(2)]
+    now = datetime.now(timezone.utc)
+    claimed = claim_sync_states(get_due_sync_states(now), now)
+    assert len(claimed) == 2
+
+    # Neither a concurrent cycle nor an on-demand sync gets the claimed Products
+    assert get_due_sync_states(now) == []
+    assert claim_sync_states(get_sync_states([products[0].id]), now) == []
+    sync_products_task([str(products[0].id)])
+    mock_iter_product_offers.assert_not_called()
+
+    release_sync_states(claimed[:1])
+    assert get_due_sync_states(now) == claimed[:1]
+    # Claims of a worker that died expire
+    expired_at = now + timedelta(seconds=settings.OFFERS_SYNC_CLAIM_TIMEOUT)
+    assert len(claim_sync_states(get_sync_states([p.id for p in products]), expired_at)) == 2
+
+
+def test_celery_task_routes():
+    def route(task):
+        options = celery_app.amqp.router.route({}, f'product_catalogue.tasks.{task}')
+        return options['queue'].name, options.get('priority')
+
+    assert route('fetch_offers_task') == ('sync', 5)
+    assert route('purge_deleted_products_task') == ('sync', 1)
+    assert route('sync_products_task') == ('refresh', 5)
+    assert celery_app.amqp.queues['refresh'].queue_arguments == {'x-max-priority': 9}
+
+
+@pytest.mark.django_db
+def test_admin_changelists(admin_client):
+    product = _create_test_product()
+    _create_test_offers(product)
+    ProductSyncState.objects.create(product=product)
+    url = '/admin/product_catalogue/offer/'
+
+    with CaptureQueriesContext(connection) as queries:
+        response = admin_client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    _create_test_offers(_create_test_product(), count=20)
+    with CaptureQueriesContext(connection) as more_offers_queries:
+        admin_client.get(url)
+    assert len(more_offers_queries) == len(queries)
+
+    response = admin_client.get(url, {'q': str(product.id)})
+    assert response.context['cl'].result_count == 5
+    for model in ['product', 'productsyncstate', 'user', 'offercredentials']:
+        response = admin_client.get(f'/admin/product_catalogue/{model}/', {'q': 'test'})
+        assert response.status_code == status.HTTP_200_OK
+
+
+@patch('product_catalogue.services.OffersService.iter_product_offers')
+@pytest.mark.django_db
+def test_admin_actions(mock_iter_product_offers, admin_client):
+    product = _create_test_product()
+    offers = _create_test_offers(product)
+
+    response = admin_client.post(
+        '/admin/product_catalogue/offer/',
+        {'action': 'close', '_selected_action': [str(offers[1].id), str(offers[2].id)]},
+    )
+    assert response.status_code == status.HTTP_302_FOUND
+    assert Offer.objects.filter(items_in_stock__gt=0).count() == 2
+    assert OfferPriceEvent.objects.filter(items_in_stock=0).count() == 2
+    product.refresh_from_db()
+    assert product.open_offer_count == 2
+
+    with patch('product_catalogue.tasks.sync_products_task.delay') as sync_task:
+        admin_client.post(
+            '/admin/product_catalogue/product/',
+            {'action': 'sync_offers', '_selected_action': [str(product.id)]},
+        )
+    mock_iter_product_offers.return_value = iter([[]])
+    sync_products_task(*sync_task.call_args.args)
+    mock_iter_product_offers.assert_called_once_with(product.id)
+    assert Offer.objects.filter(items_in_stock__gt=0).count() == 0
+
+
+@pytest.mark.django_db
+def test_admin_actions_permissions(client, django_user_model):
+    product = _create_test_product()
+    offers = _create_test_offers(product)
+    ProductSyncState.objects.create(product=product, failure_count=3)
+    open_offers = Offer.objects.filter(items_in_stock__gt=0).count()
+    staff = django_user_model.objects.create_user('staff', password='staff', is_staff=True)
+    staff.user_permissions.set(
+        Permission.objects.filter(
+            codename__in=['view_product', 'view_offer', 'view_productsyncstate']
+        )
+    )
+    client.force_login(staff)
+
+    # View-only staff doesn't get the actions
+    with patch('product_catalogue.tasks.sync_products_task.delay') as sync_task:
+        for model, action, selected in [
+            ('product', 'sync_offers', product.id),
+            ('product', 'soft_delete', product.id),
+            ('offer', 'close', offers[1].id),
+            ('productsyncstate', 'requeue', product.id),
+        ]:
+            client.post(
+                f'/admin/product_catalogue/{model}/',
+                {'action': action, '_selected_action': [str(selected)]},
+            )
+    sync_task.assert_not_called()
+    assert Product.objects.filter(id=product.id).exists()
+    assert Offer.objects.filter(items_in_stock__gt=0).count() == open_offers
+    assert ProductSyncState.objects.get(product=product).failure_count == 3
+
+    staff.user_permissions.add(Permission.objects.get(codename='change_offer'))
+    client.post(
+        '/admin/product_catalogue/offer/',
+        {'action': 'close', '_selected_action': [str(offers[1].id)]},
+    )
+    assert Offer.objects.filter(items_in_stock__gt=0).count() == open_offers - 1
+
+
+@override_settings(PRODUCT_READS_FLUSH_INTERVAL=0)
+@pytest.mark.django_db(transaction=True)
+def test_product_reads_flushed_without_further_reads():
+    product = _create_test_product()
+    record_product_read(product.id)
+    # No later read is needed for the reads to reach the database
+    states = ProductSyncState.objects.filter(product=product, read_count=1)
+    for _ in range(50):
+        if states.exists():
+            break
+        time.sleep(0.1)
+    assert states.exists()
+
+
+@pytest.mark.django_db
+def test_sync_tiers():
+    now = datetime.now(timezone.utc)
+    read_product = _create_test_product()
+    churn_product = _create_test_product()
+    idle_product = _create_test_product()
+    for _ in range(100):
+        record_product_read(read_product.id)
+    # Reads reach the sync workers through the database
+    flush_product_reads()
+    assert ProductSyncState.objects.get(product=read_product).read_count == 100
+
+    states = get_due_sync_states(now)
+    assert len(states) == 3
+    reschedule(states, {churn_product.id: 50}, now)
+    assert ProductSyncState.objects.get(product=read_product).read_count == 0
+
+    tiers = dict(ProductSyncState.objects.values_list('product_id', 'tier'))
+    assert tiers[read_product.id] == ProductSyncState.Tier.HOT
+    assert tiers[churn_product.id] == ProductSyncState.Tier.HOT
+    assert tiers[idle_product.id] == ProductSyncState.Tier.COLD
+    assert get_due_sync_states(now) == []
+
+
+@pytest.mark.django_db
+def test_sync_product_offers():
+    product = _create_test_product()
+    offers = _create_test_offers(product)
+    new_offer_id = uuid4()
+    offers_from_api = [
+        {'id': str(offers[0].id), 'price': 700, 'items_in_stock': 5},
+        {'id': str(offers[2].id), 'price': offers[2].price, 'items_in_stock': 60},
+        {'id': str(offers[3].id), 'price': 100, 'items_in_stock': 90},
+        {'id': str(new_offer_id), 'price': 10000, 'items_in_stock': 200},
+    ]
+
+    result = sync_product_offers(product, [offers_from_api[:2], offers_from_api[2:]])
+    assert result == {'created': 2, 'updated': 1, 'sold_out': 2}
+    assert Offer.objects.get(id=offers[0].id).closed_at is None
+    assert Offer.objects.get(id=offers[0].id).items_in_stock == 5
+    assert Offer.objects.get(id=offers[1].id).closed_at is not None
+    assert Offer.objects.get(id=offers[3].id).price == 100
+    assert Offer.objects.get(id=new_offer_id).product_id == product.id
+    assert product.offers.filter(items_in_stock__gt=0).count() == 4
+
+    product.refresh_from_db()
+    assert product.best_price == 100
+    assert product.avg_price == pytest.approx((700 + offers[2].price + 100 + 10000) / 4)
+    assert product.open_offer_count == 4
+    assert product.total_stock == 5 + 60 + 90 + 200
+
+
+@pytest.mark.django_db
+def test_sync_product_offers_price_events(user):
+    product = _create_test_product()
+    offer_id, new_offer_id = uuid4(), uuid4()
+    offers_from_api = [{'id': str(offer_id), 'price': 1000, 'items_in_stock': 5}]
+
+    sync_product_offers(product, [offers_from_api])
+    sync_product_offers(product, [offers_from_api])
+    assert OfferPriceEvent.objects.count() == 1
+
+    offers_from_api = [
+        {'id': str(offer_id), 'price': 2000, 'items_in_stock': 5},
+        {'id': str(new_offer_id), 'price': 3000, 'items_in_stock': 1},
+    ]
+    sync_product_offers(product, [offers_from_api])
+    sync_product_offers(product, [offers_from_api[1:]])
+    events = OfferPriceEvent.objects.filter(offer_id=offer_id).order_by('created_at', 'id')
+    assert [(e.price, e.items_in_stock) for e in events] == [(1000, 5), (2000, 5), (2000, 0)]
+    assert OfferPriceEvent.objects.filter(product=product).count() == 4
+
+    today = datetime.now(timezone.utc).strftime('%d.%m.%Y')
+    url = f'/api/v1/products/{product.id}/price_change/?fromDay={today}'
+    response = _send_get_request_auth(url, user)
+    assert response.data['start_price'] == 2500
+    assert response.data['end_price'] == 3000
+
+
+@pytest.mark.django_db
+def test_stream_product_offer_changes(user, django_capture_on_commit_callbacks):
+    product, other_product = _create_test_product(), _create_test_product()
+    offer_id = uuid4()
+
+    with patch('product_catalogue.broadcast._broker', InMemoryBroker()):
+        response = _send_get_request_auth(
+            reverse('product-stream', kwargs={'pk': product.id}), user
+        )
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = iter(response.streaming_content)
+        assert next(stream) == b'retry: 3000\n\n'
+
+        with django_capture_on_commit_callbacks(execute=True):
+            for p, id, price in [(other_product, uuid4(), 1), (product, offer_id, 700)]:
+                sync_product_offers(p, [[{'id': str(id), 'price': price, 'items_in_stock': 5}]])
+        event, data = next(stream).decode().splitlines()[:2]
+        response.close()
+
+    assert event == 'event: offers'
+    assert json.loads(data.removeprefix('data: ')) == {
+        'product_id': str(product.id),
+        'events': [
+            {'type': 'created', 'offer': {'id': str(offer_id), 'price': 700, 'items_in_stock': 5}}
+        ],
+    }
+
+
+@pytest.mark.django_db
+@override_settings(OFFER_STREAM_MAX_EVENTS=2)
+def test_sync_product_offers_publishes_resync(django_capture_on_commit_callbacks):
+    product = _create_test_product()
+    offers_from_api = [
+        {'id': str(uuid4()), 'price': 100 * i, 'items_in_stock': 5} for i in range(1, 4)
+    ]
+
+    with patch('product_catalogue.broadcast._broker') as broker:
+        with django_capture_on_commit_callbacks(execute=True):
+            result = sync_product_offers(product, [offers_from_api[:2], offers_from_api[2:]])
+        assert result == {'created': 3, 'updated': 0, 'sold_out': 0}
+        # Too many changes to publish one by one
+        broker.publish.assert_called_once_with(
+            {'product_id': str(product.id), 'events': [{'type': 'resync'}]}
+        )
+
+        broker.reset_mock()
+        with django_capture_on_commit_callbacks(execute=True):
+            result = sync_product_offers(product, [offers_from_api[1:]])
+        assert result == {'created': 0, 'updated': 0, 'sold_out': 1}
+        broker.publish.assert_called_once_with(
+            {
+                'product_id': str(product.id),
+                'events': [
+                    {
+                        'type': 'sold_out',
+                        'offer': {
+                            'id': offers_from_api[0]['id'],
+                            'price': 100,
+                            'items_in_stock': 0,
+                        },
+                    }
+                ],
+            }
+        )
+# Closing the responses closes the database connection like at the end of a request
+@pytest.mark.django_db(transaction=True)
+@override_settings(OFFER_STREAM_HEARTBEAT_INTERVAL=0, OFFER_STREAM_MAX_CONNECTIONS=1)
+def test_stream_heartbeat_and_limit(user):
+    product = _create_test_product()
+    url = reverse('product-stream', kwargs={'pk': product.id})
+
+    broker = InMemoryBroker()
+    with patch('product_catalogue.broadcast._broker', broker):
+        response = _send_get_request_auth(url, user)
+        stream = iter(response.streaming_content)
+        assert next(stream) == b'retry: 3000\n\n'
+        # Messages of other Products keep coming, the heartbeat still goes out
+        broker.publish({'product_id': str(uuid4()), 'events': []})
+        assert next(stream) == b': keepalive\n\n'
+
+        refused = _send_get_request_auth(url, user)
+        assert refused.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert refused['Retry-After'] == '3'
+
+        # Closing frees the slot, even of a stream that never started
+        response.close()
+        response = _send_get_request_auth(url, user)
+        assert response.status_code == status.HTTP_200_OK
+        response.close()
+        response = _send_get_request_auth(url, user)
+        assert response.status_code == status.HTTP_200_OK
+        response.close()
+
+
+@pytest.mark.django_db
+def test_filter_products_by_best_price(user):
+    url = reverse('product-list')
+    cheap, expensive, sold_out = [_create_test_product() for _ in range(3)]
+    for product, price in [(cheap, 100), (expensive, 1000)]:
+        Offer.objects.create(product=product, price=price, items_in_stock=1)
+    update_offer_summaries([cheap.id, expensive.id, sold_out.id])
+
+    response = _send_get_request_auth(f'{url}?ordering=-best_price', user)
+    assert [str(p['id']) for p in response.data] == [
+        str(expensive.id),
+        str(cheap.id),
+        str(sold_out.id),
+    ]
+    assert response.data[0]['best_price'] == 1000
+    assert response.data[0]['open_offer_count'] == 1
+
+    response = _send_get_request_auth(f'{url}?price_max=500', user)
+    assert [str(p['id']) for p in response.data] == [str(cheap.id)]
+
+    response = _send_get_request_auth(f'{url}?in_stock=false', user)
+    assert [str(p['id']) for p in response.data] == [str(sold_out.id)]
+
+    response = _send_get_request_auth(f'{url}?ordering=description', user)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    if connection.vendor == 'postgresql':
+        # Descending order (keeping Products without a price last) is an index scan
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+        plan = Product.objects.order_by(F('best_price').desc(nulls_last=True), 'id').explain()
+        assert 'product_best_price_desc_idx' in plan
+
+
+@pytest.mark.django_db
+def test_sync_product_offers_sqlite_uses_orm():
+    product = _create_test_product()
+    with patch('product_catalogue.sync.connection') as connection, patch(
+        'product_catalogue.sync._sync_offers_copy'
+    ) as sync_offers_copy:
+        connection.vendor = 'sqlite'
+        sync_product_offers(product, [[]])
+    sync_offers_copy.assert_not_called()
+
+
+def test_offers_service_created_lazily():
+    from product_catalogue import tasks, views
+    from product_catalogue.openapi import AuthenticationSchema
+
+    assert not hasattr(tasks, 'offers_service')
+    assert views.ProductViewSet().offers_service is get_offers_service()
+    assert isinstance(views.ProductViewSet().schema, AuthenticationSchema)
+
+
+def test_schema_tooling_not_loaded_to_serve_requests():
+    # Run in a fresh interpreter, since this one may have generated the schema
+    script = (
+        'import sys, django; django.setup(); '
+        'from django.urls import resolve; '
+        'resolve("/api/v1/products/"); resolve("/api/v1/products/1/"); '
+        'print("drf_spectacular.openapi" in sys.modules)'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == 'False'
+
+
+def test_schema_served_from_prebuilt_file(tmp_path):
+    url = reverse('schema')
+    client = APIClient()
+    with override_settings(OPENAPI_SCHEMA_DIR=tmp_path, CODE_VERSION='prebuilt'):
+        call_command('build_openapi_schema', stdout=io.StringIO())
+        schema = json.loads((tmp_path / 'schema-prebuilt.json').read_bytes())
+        assert '/api/v1/products/' in schema['paths']
+
+        schema['info']['title'] = 'Prebuilt'
+        (tmp_path / 'schema-prebuilt.json').write_text(json.dumps(schema))
+        response = client.get(url, HTTP_ACCEPT='application/json')
+        assert response.status_code == status.HTTP_200_OK
+        assert json.loads(response.content)['info']['title'] == 'Prebuilt'
+
+        response = client.get(
+            url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b''
+
+
+def test_iter_json_array_across_chunks():
+    body = json.dumps(
+        [{'id': str(uuid4()), 'price': i, 'items_in_stock': 10 * i} for i in range(20)]
+        + [{'name': 'Prodúct'}, 12345, []]
+    ).encode()
+    chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+
+    assert list(_iter_json_array(chunks)) == json.loads(body)
+    assert list(_iter_json_array([b' [ ', b'] '])) == []
+    with pytest.raises(ValueError):
+        list(_iter_json_array([b'[{"id": 1}, {"id"']))
+
+    # Values spanning many chunks are decoded, malformed ones don't buffer the whole body
+    large_value = {'description': 'x' * 100_000}
+    body = json.dumps([large_value]).encode()
+    assert list(_iter_json_array(body[i:i + 100] for i in range(0, len(body), 100))) == [
+        large_value
+    ]
+    read_chunks = []
+
+    def malformed_chunks():
+        yield b'[{"id" 1}, '
+        for _ in range(100_000):
+            read_chunks.append(1)
+            yield b'{"id": 1}, ' * 10
+
+    with pytest.raises(ValueError):
+        list(_iter_json_array(malformed_chunks()))
+    assert len(read_chunks) < 20_000
+
+
+def test_iter_product_offers_batches():
+    offers = [{'id': str(uuid4()), 'price': i, 'items_in_stock': i} for i in range(5)]
+
+    def handler(request):
+        return httpx.Response(200, json=offers)
+
+    service = OffersService()
+    service.base_url = 'http://offers'
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    with patch.object(
+        service.credential_pool, 'acquire', return_value=OfferCredentials(access_token='token')
+    ), patch.object(service, '_http_client', return_value=client):
+        batches = list(service.iter_product_offers(uuid4(), batch_size=2))
+
+    assert batches == [offers[0:2], offers[2:4], offers[4:]]
+
+
+def test_offers_service_not_found():
+    def handler(request):
+        return httpx.Response(404)
+
+    service = OffersService()
+    service.base_url = 'http://offers'
+    with patch.object(
+        service.credential_pool, 'acquire', return_value=OfferCredentials(access_token='token')
+    ), patch.object(
+        service,
+        '_http_client',
+        side_effect=lambda timeout: httpx.Client(transport=httpx.MockTransport(handler)),
+    ):
+        with pytest.raises(ProductNotFoundError):
+            service.get_product_offers(uuid4())
+        # Only the Offers endpoint tells about the Product
+        with pytest.raises(Exception, match='Error registering Product with status: 404') as error:
+            service.register_product_for_offers({'id': str(uuid4())})
+        assert not isinstance(error.value, ProductNotFoundError)
+
+
+@override_settings(OFFERS_SERVICE_TIMEOUT=10)
+def test_offers_service_deadline():
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions['timeout']['read'])
+        return httpx.Response(401 if len(timeouts) == 1 else 200, json=[])
+
+    def generate_new_access_token(credentials):
+        time.sleep(0.2)
+
+    service = OffersService()
+    service.base_url = 'http://offers'
+    with patch.object(
+        service.credential_pool, 'acquire', return_value=OfferCredentials(access_token='token')
+    ), patch.object(
+        service, '_generate_new_access_token', side_effect=generate_new_access_token
+    ), patch.object(
+        service,
+        '_http_client',
+        side_effect=lambda timeout: httpx.Client(
+            transport=httpx.MockTransport(handler), timeout=timeout
+        ),
+    ):
+        assert service.get_product_offers(uuid4()) == []
+        assert timeouts == [10, 10]
+
+        # The retry after refreshing the Access Token only gets what is left
+        timeouts.clear()
+        with deadline(1):
+            service.get_product_offers(uuid4())
+        assert timeouts[0] <= 1 and timeouts[1] <= timeouts[0] - 0.2
+
+        timeouts.clear()
+        with deadline(0.1), pytest.raises(DeadlineExceeded):
+            service.get_product_offers(uuid4())
+        assert len(timeouts) == 1
+
+
+@override_settings(OFFERS_SERVICE_CREDENTIAL_MAX_FAILURES=3)
+@pytest.mark.django_db
+def test_credential_pool():
+    refresh_tokens = [str(uuid4()), str(uuid4())]
+    pool = CredentialPool(refresh_tokens, rate='1/min')
+
+    # Calls take turns over the Refresh Tokens, each with its own rate limit
+    acquired = [pool.acquire(), pool.acquire()]
+    assert sorted(credentials.refresh_token_str for credentials in acquired) == sorted(
+        refresh_tokens
+    )
+    with deadline(0.1), pytest.raises(DeadlineExceeded):
+        pool.acquire()
+
+    for _ in range(3):
+        pool.report_failure(acquired[0])
+    assert pool.healthy_refresh_tokens() == [acquired[1].refresh_token_str]
+    pool.report_failure(acquired[1], remove=True)
+    with pytest.raises(NoCredentialsAvailable):
+        pool.acquire()
+
+
+def test_credential_pool_rate_limit():
+    refresh_token = str(uuid4())
+    pool = CredentialPool([refresh_token], rate='10/min')
+    barrier = threading.Barrier(20, timeout=5)
+    wait_times = []
+
+    def take_call():
+        barrier.wait()
+        wait_times.append(pool._take_call(refresh_token))
+
+    with patch.object(CredentialPool, 'timer', return_value=6000.0 + 45):
+        threads = [threading.Thread(target=take_call) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # Concurrent calls never take more than the limit
+    assert wait_times.count(None) == 10
+    assert set(wait_times) == {None, 15}
+
+    with patch.object(CredentialPool, 'timer', return_value=6060.0):
+        assert pool._take_call(refresh_token) is None
+
+
+@pytest.mark.django_db
+def test_offers_service_rate_limited_credentials():
+    refresh_tokens = [str(uuid4()), str(uuid4())]
+    for refresh_token, access_token in zip(refresh_tokens, ['limited', 'valid']):
+        OfferCredentials.objects.create(refresh_token=refresh_token, access_token=access_token)
+    access_tokens = []
+
+    def handler(request):
+        access_tokens.append(request.headers['Bearer'])
+        return httpx.Response(429 if request.headers['Bearer'] == 'limited' else 200, json=[])
+
+    with override_settings(OFFERS_SERVICE_REFRESH_TOKENS=refresh_tokens):
+        service = OffersService()
+    service.base_url = 'http://offers'
+    with patch.object(
+        service,
+        '_http_client',
+        side_effect=lambda timeout: httpx.Client(
+            transport=httpx.MockTransport(handler), timeout=timeout
+        ),
+    ):
+        with pytest.raises(RateLimitedError):
+            service.get_product_offers(uuid4())
+        for _ in range(3):
+            assert service.get_product_offers(uuid4()) == []
+
+    # The rate limited credentials are left out right away
+    assert access_tokens == ['limited', 'valid', 'valid', 'valid']
+
+
+@override_settings(OFFERS_WEBHOOK_SECRET='webhook-secret')
+@pytest.mark.django_db
+def test_offers_webhook():
+    product = _create_test_product()
+    offers = _create_test_offers(product)
+    new_offer_id = uuid4()
+    events = [
+        {
+            'type': 'created',
+            'product_id': str(product.id),
+            'offer': {'id': str(new_offer_id), 'price': 900, 'items_in_stock': 3},
+        },
+        {
+            'type': 'updated',
+            'product_id': str(product.id),
+            'offer': {'id': str(offers[1].id), 'price': 650, 'items_in_stock': 10},
+        },
+        {
+            'type': 'sold_out',
+            'product_id': str(product.id),
+            'offer': {'id': str(offers[2].id)},
+        },
+        {
+            'type': 'created',
+            'product_id': str(uuid4()),
+            'offer': {'id': str(uuid4()), 'price': 1, 'items_in_stock': 1},
+        },
+    ]
+
+    response = _send_webhook_request({'events': events}, 'webhook-secret')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {'created': 1, 'updated': 1, 'sold_out': 1}
+    assert Offer.objects.get(id=new_offer_id).price == 900
+    assert Offer.objects.get(id=offers[1].id).price == 650
+    assert Offer.objects.get(id=offers[2].id).closed_at is not None
+    assert Offer.objects.count() == 6
+
+
+@override_settings(OFFERS_WEBHOOK_SECRET='webhook-secret')
+@pytest.mark.django_db
+def test_offers_webhook_invalid_signature():
+    response = _send_webhook_request({'events': []}, 'another-secret')
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@override_settings(OFFERS_WEBHOOK_SECRET='webhook-secret')
+@pytest.mark.django_db
+def test_offers_webhook_invalid_event():
+    events = [{'type': 'updated', 'product_id': str(uuid4()), 'offer': {'id': str(uuid4())}}]
+
+    response = _send_webhook_request({'events': events}, 'webhook-secret')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 @pytest.mark.django_db
 def test_product_offers_compare_two_dates(user):
     product = _create_test_product()
@@ -302,6 +1431,89 @@ def test_list_offers_no_auth():
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
 
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+def test_replica_router_reads():
+    router = ReplicaRouter()
+    with patch('marketplace.db_router.replica_lag', return_value=0):
+        assert router.db_for_read(Product) is None
+        with read_from_replica():
+            assert router.db_for_read(Product) == 'replica_0'
+            assert router.db_for_write(Product) == 'default'
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], DATABASE_REPLICA_MAX_LAG=5)
+def test_replica_router_lagging_replica():
+    router = ReplicaRouter()
+    with patch('marketplace.db_router.replica_lag', return_value=30):
+        with read_from_replica():
+            assert router.db_for_read(Product) == 'default'
+
+
+@pytest.mark.django_db
+def test_query_replica_lag():
+    # Without replicas in the test setup, this checks the query runs and treats
+    # a server that isn't replaying anything as caught up
+    assert _query_replica_lag('default') == 0
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+@pytest.mark.django_db
+def test_create_product_pins_reads_to_primary(user):
+    with patch(
+        'product_catalogue.services.OffersService.register_product_for_offers',
+        return_value=None,
+    ):
+        url = reverse('product-list')
+        data = {'name': 'Test Product', 'description': 'Test Description'}
+
+        response = _send_post_request_auth(url, data, user)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert is_pinned_to_primary(str(user.access_token))
+
+
+def test_fast_json_renderer_matches_drf():
+    data = {
+        'id': uuid4(),
+        'name': 'Prodúct \u2028',
+        'created_at': datetime(2023, 11, 15, 6, 21, 0, 123456),
+        'offers': [{'price': 500, 'items_in_stock': 0}],
+        1: None,
+    }
+
+    assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+    assert FastJSONRenderer().render(None) == b''
+
+
+def test_fast_json_parser():
+    data = FastJSONParser().parse(io.BytesIO(b'{"email": "test@gmail.com"}'))
+    assert data == {'email': 'test@gmail.com'}
+
+
+@pytest.mark.django_db
+def test_list_offers_compressed(user):
+    product = _create_test_product()
+    _create_test_offers(product, 50)
+    url = reverse('offer-list')
+    client = APIClient()
+    headers = {**_get_access_token_header(user), 'Accept-Encoding': 'gzip'}
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.content))) == 50
+
+
+@pytest.mark.django_db
+def test_small_response_not_compressed(user):
+    url = reverse('offer-list')
+    client = APIClient()
+    headers = {**_get_access_token_header(user), 'Accept-Encoding': 'gzip, br'}
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert not response.has_header('Content-Encoding')
+
+
 def _create_offers_for_compare_tests(
     product: Product, from_day: str, to_day: str
 ) -> None:
@@ -316,12 +1528,13 @@ def _create_offers_for_compare_tests(
     _create_closed_offer(product, to_day + timedelta(hours=3), 3500)
     _create_closed_offer(product, to_day + timedelta(hours=25), 4000)
 
-    Offer.objects.create(
+    offer = Offer.objects.create(
         price=5000,
         items_in_stock=20,
         product=product,
         created_at=to_day + timedelta(hours=20),
     )
+    OfferPriceEvent.from_offer(offer).save()
     
     
 def _str_to_datetime(date_str):
@@ -350,13 +1563,38 @@ def _create_test_offers(product: Product, count: int = 5) -> [Offer]:
 
 
 def _create_closed_offer(product: Product, created_at: datetime, price: int) -> Offer:
-    return Offer.objects.create(
+    offer = Offer.objects.create(
         price=price,
         items_in_stock=0,
         product=product,
         created_at=created_at,
         closed_at=created_at + timedelta(hours=5),
     )
+    OfferPriceEvent.objects.bulk_create(
+        [
+            OfferPriceEvent(offer=offer, product=product, created_at=created_at, price=price, items_in_stock=10),
+            OfferPriceEvent.from_offer(offer, offer.closed_at),
+        ]
+    )
+    return offer
+
+
+class _SlowCache:
+    """
+    Lets other threads run before every cache call, to surface races.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def __getattr__(self, name):
+        attr = getattr(self._cache, name)
+
+        def call(*args, **kwargs):
+            time.sleep(0.001)
+            return attr(*args, **kwargs)
+
+        return call
 
 
 def _send_get_request_auth(url: str, user: User):
@@ -371,5 +1609,21 @@ def _send_post_request_auth(url: str, data: dict, user: User):
     return client.post(url, data, format='json', headers=headers)
 
 
+def _send_webhook_request(data: dict, secret: str):
+    body = json.dumps(data).encode()
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256
+    ).hexdigest()
+    headers = {
+        'X-Offers-Timestamp': timestamp,
+        'X-Offers-Signature': f'sha256={signature}',
+    }
+    client = APIClient()
+    return client.post(
+        reverse('offers-webhook'), body, content_type='application/json', headers=headers
+    )
+
+
 def _get_access_token_header(user: User):
     return {'Access-Token': user.access_token}
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class WindowRateThrottle(BaseThrottle):
+    """
+    Rate limiting per Access-Token (or client IP without one). Every request
+    is counted against the `user` rate and the rate of the view's
+    `throttle_scope`, "num/period" in DEFAULT_THROTTLE_RATES. Requests are
+    counted per fixed period in the Django cache, so at most `num` of them
+    pass per period, shared by all processes only with a shared CACHE_BACKEND
+    (e.g. Redis) and per process otherwise.
+    """
+
+    cache = default_cache
+    timer = time.time
+    user_scope = 'user'
+    wait_time = None
+    # Throttles are created per request, so the lock is shared by the class
+    _lock = threading.Lock()
+
+    def allow_request(self, request, view) -> bool:
+        client = self.get_client_key(request)
+        now = self.timer()
+        self.wait_time = None
+        counted = []
+
+        for scope, (capacity, refill_rate) in self.get_rates(view):
+            period = capacity / refill_rate
+            window = int(now // period)
+            key = f'throttle:{scope}:{client}:{window}'
+            counted.append(key)
+            if self._count_request(key, period) > capacity:
+                self.wait_time = max(self.wait_time or 0, (window + 1) * period - now)
+
+        if self.wait_time is None:
+            return True
+
+        # Rejected requests don't use up the other rates of the client
+        with self._lock:
+            for key in counted:
+                try:
+                    self.cache.decr(key)
+                except ValueError:
+                    pass
+        return False
+
+    def wait(self) -> float:
+        return self.wait_time
+
+    def get_client_key(self, request) -> str:
+        access_token = request.headers.get('Access-Token')
+        if access_token:
+            return hashlib.sha256(str(access_token).encode()).hexdigest()[:32]
+        return self.get_ident(request)
+
+    def get_rates(self, view) -> [(str, (int, float))]:
+        rates = []
+        for scope in (self.user_scope, getattr(view, 'throttle_scope', None)):
+            rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+            if rate is not None:
+                rates.append((scope, self.parse_rate(rate)))
+        return rates
+
+    def _count_request(self, key: str, period: float) -> int:
+        # add and incr are atomic on Redis and Memcached, the lock keeps the
+        # threads of this process from racing on other backends
+        with self._lock:
+            self.cache.add(key, 0, timeout=period + 1)
+            try:
+                return self.cache.incr(key)
+            except ValueError:
+                # Expired in between, the period is over anyway
+                self.cache.add(key, 1, timeout=period + 1)
+                return 1
+
+    @staticmethod
+    def parse_rate(rate: str) -> (int, float):
+        """
+        Returns the number of calls and their rate per second of a
+        "num/period" rate, period being one of s(econd), m(inute), h(our), d(ay).
+        """
+        num, period = rate.split('/')
+        duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        return int(num), int(num) / duration
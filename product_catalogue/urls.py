@@ -2,16 +2,24 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from product_catalogue import views
 
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-
 
 router = DefaultRouter()
 router.register(r'products', views.ProductViewSet, basename="product")
 router.register(r'offers', views.OfferViewSet, basename="offer")
 
 urlpatterns = [
+    path('api/v1/offers/webhook', views.OffersWebhookView.as_view(), name='offers-webhook'),
     path('api/v1/', include(router.urls)),
     path('api/v1/auth', views.UsersView.as_view(), name='auth'),
-    path('api/docs/schema', SpectacularAPIView.as_view(), name='schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    # The schema tooling is only loaded once the docs are requested
+    path(
+        'api/docs/schema',
+        views.LazyView('product_catalogue.schema_views.SchemaView'),
+        name='schema',
+    ),
+    path(
+        'api/docs/',
+        views.LazyView('drf_spectacular.views.SpectacularSwaggerView', url_name='schema'),
+        name='swagger-ui',
+    ),
 ]
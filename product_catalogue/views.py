@@ -3,39 +3,97 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework import status
-from django.db import transaction
-from django.db.models import Avg, Q
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.schemas.inspectors import DefaultSchema, ViewInspector
+from django.db import connection, transaction
+from django.db.models import Avg, Q, Window
+from django.db.models.functions import Lead, RowNumber
 from datetime import datetime, timedelta
-from django.http import HttpResponseForbidden
-from drf_spectacular.openapi import AutoSchema
-from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
-
-from .models import Product, Offer, User
-from .serializers import ProductSerializer, OfferSerializer, UserSerializer
-from .services import OffersService
-
-
-class AuthenticationSchema(AutoSchema):
-    global_params = [
-        OpenApiParameter(
-            name="Access-Token",
-            type=str,
-            location=OpenApiParameter.HEADER,
-            description="Access token from the `auth` endpoint",
-        )
-    ]
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.utils.module_loading import import_string
+import hashlib
+import hmac
+import time
+
+from marketplace.db_router import read_from_replica, pin_to_primary, is_pinned_to_primary
+from .models import Product, Offer, OfferPriceEvent, User
+from .serializers import (
+    ProductSerializer,
+    OfferSerializer,
+    UserSerializer,
+    ProductValuesSerializer,
+    OfferValuesSerializer,
+    OfferEventSerializer,
+    ProductDeleteSerializer,
+)
+from .deadlines import DeadlineExceeded
+from .services import get_offers_service
+from .sync import apply_offer_events
+from .broadcast import open_offer_stream
+from .deletion import soft_delete_products
+from .tasks import purge_deleted_products_task
+from .scheduling import record_product_read
+from .filters import ProductSearchFilter, ProductFilter, OfferFilter
+from .pagination import ProductPagination, OfferPagination
+
+
+class LazySchema(DefaultSchema):
+    """
+    Like DRF's `DefaultSchema`, but for a given schema class which is only
+    imported once the API schema is generated, so serving requests never
+    loads the schema tooling.
+    """
+
+    def __init__(self, schema_class_path: str):
+        super().__init__()
+        self.schema_class_path = schema_class_path
+
+    def __get__(self, instance, owner):
+        # Looked up on the class when routers list the actions of a viewset
+        if instance is None:
+            return self
+        result = ViewInspector.__get__(self, instance, owner)
+        if not isinstance(result, LazySchema):
+            return result
+
+        inspector = import_string(self.schema_class_path)()
+        inspector.view = instance
+        return inspector
 
-    def get_override_parameters(self):
-        params = super().get_override_parameters()
-        return params + self.global_params
+
+class LazyView:
+    """
+    URL callback of an API view class which is only imported on the first
+    request to it, or once the API schema is generated and inspects `cls`.
+    """
+
+    csrf_exempt = True
+
+    def __init__(self, view_class_path: str, **initkwargs):
+        self.view_class_path = view_class_path
+        self.initkwargs = initkwargs
+        self._view = None
+
+    @property
+    def cls(self):
+        return import_string(self.view_class_path)
+
+    def __call__(self, request, *args, **kwargs):
+        if self._view is None:
+            self._view = self.cls.as_view(**self.initkwargs)
+        return self._view(request, *args, **kwargs)
 
 
 class OffersServiceMixin:
-    offers_service = OffersService()
+    @property
+    def offers_service(self):
+        return get_offers_service()
 
 
 class AuthenticationMixin:
-    schema = AuthenticationSchema()
+    schema = LazySchema('product_catalogue.openapi.AuthenticationSchema')
     
     def dispatch(self, request, *args, **kwargs):
         access_token = request.headers.get('Access-Token')
@@ -46,9 +104,141 @@ class AuthenticationMixin:
             return HttpResponseForbidden('Invalid Access-Token')
 
 
-class ProductViewSet(AuthenticationMixin, ModelViewSet, OffersServiceMixin):
+class ReplicaReadMixin:
+    replica_actions = {'list', 'retrieve'}
+
+    def dispatch(self, request, *args, **kwargs):
+        access_token = request.headers.get('Access-Token')
+        action = self.action_map.get(request.method.lower())
+
+        if action not in self.replica_actions:
+            response = super().dispatch(request, *args, **kwargs)
+            if request.method not in SAFE_METHODS and response.status_code < 400:
+                pin_to_primary(access_token)
+            return response
+
+        if is_pinned_to_primary(access_token):
+            return super().dispatch(request, *args, **kwargs)
+
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+# Replays the stored response of `idempotent_actions` requests repeated with the
+# same `Idempotency-Key` header (per Access-Token), without running the action
+# again. Keys reused with a different request are rejected. (Not a docstring,
+# which would become the description of all Product endpoints in the schema.)
+class IdempotencyMixin:
+    idempotent_actions = {'create', 'bulk_delete'}
+    idempotency_header = 'Idempotency-Key'
+
+    def dispatch(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        action = self.action_map.get(request.method.lower())
+        if key is None or action not in self.idempotent_actions:
+            return super().dispatch(request, *args, **kwargs)
+
+        if not 0 < len(key) <= 255:
+            return JsonResponse(
+                {'error': f'{self.idempotency_header} must have 1 to 255 characters.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cache_key = 'idempotency:' + hashlib.sha256(
+            f'{request.headers.get("Access-Token")}:{key}'.encode()
+        ).hexdigest()
+        fingerprint = hashlib.sha256(
+            f'{request.method}:{request.path}:'.encode() + request.body
+        ).hexdigest()
+
+        if not cache.add(cache_key, (fingerprint, None), settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            stored_fingerprint, stored_response = cache.get(cache_key, (None, None))
+            if stored_fingerprint is not None and stored_fingerprint != fingerprint:
+                return JsonResponse(
+                    {'error': f'{self.idempotency_header} was already used for another request.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if stored_response is None:
+                return JsonResponse(
+                    {'error': f'Request with this {self.idempotency_header} is in progress.'},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            status_code, content_type, content, location = stored_response
+            response = HttpResponse(content, status=status_code, content_type=content_type)
+            if location:
+                response['Location'] = location
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+
+        if not status.is_success(response.status_code):
+            # Failures (e.g. unavailable Offers Microservice) can be retried
+            cache.delete(cache_key)
+            return response
+
+        if hasattr(response, 'render'):
+            response.render()
+        cache.set(
+            cache_key,
+            (
+                fingerprint,
+                (
+                    response.status_code,
+                    response['Content-Type'],
+                    response.content,
+                    response.get('Location'),
+                ),
+            ),
+            settings.IDEMPOTENCY_KEY_TTL,
+        )
+        return response
+
+
+class ValuesListMixin:
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        rows = self.values_serializer_class.values_list(
+            self.filter_queryset(self.get_queryset()),
+            *getattr(self.paginator, 'position_fields', []),
+        )
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.values_serializer_class(page).data)
+
+        return Response(self.values_serializer_class(rows).data)
+
+
+class ProductViewSet(
+    IdempotencyMixin,
+    AuthenticationMixin,
+    ReplicaReadMixin,
+    ValuesListMixin,
+    ModelViewSet,
+    OffersServiceMixin,
+):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    values_serializer_class = ProductValuesSerializer
+    filter_backends = [ProductSearchFilter, ProductFilter]
+    pagination_class = ProductPagination
+    replica_actions = {'list', 'retrieve', 'price_change'}
+
+    @property
+    def throttle_scope(self) -> str:
+        # Endpoints aggregating Offers are limited separately as they are heavier
+        if self.action == 'price_change' or (
+            self.action == 'retrieve' and self._include_offers()
+        ):
+            return 'product_offers'
+        return 'products'
 
     def create(self, request, *args, **kwargs) -> Response:
         serializer = self.get_serializer(data=request.data)
@@ -58,7 +248,16 @@ class ProductViewSet(AuthenticationMixin, ModelViewSet, OffersServiceMixin):
             self.perform_create(serializer)
 
             try:
-                self.offers_service.register_product_for_offers(serializer.data)
+                self.offers_service.register_product_for_offers(
+                    {field: serializer.data[field] for field in ['id', 'name', 'description']}
+                )
+            except DeadlineExceeded:
+                transaction.set_rollback(True)
+
+                return Response(
+                    {"error": "Registering Product for Offers timed out."},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT,
+                )
             except:
                 transaction.set_rollback(True)
 
@@ -72,34 +271,49 @@ class ProductViewSet(AuthenticationMixin, ModelViewSet, OffersServiceMixin):
             serializer.data, status=status.HTTP_201_CREATED, headers=headers
         )
     
-    @extend_schema(
-        parameters=[
-            OpenApiParameter(name='includeOffers', type=bool, location=OpenApiParameter.QUERY, description='Return Active Offers for Product'),
-        ],
-    )
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
+        record_product_read(instance.pk)
         serializer = self.get_serializer(instance)
-        include_offers = request.query_params.get('includeOffers') in [1, 'True', 'true']
         data = serializer.data
 
-        if include_offers:
-            offers_data = OfferSerializer(
-                instance.offers.filter(items_in_stock__gt=0), many=True
+        if self._include_offers():
+            offers_data = OfferValuesSerializer(
+                OfferValuesSerializer.values_list(
+                    instance.offers.filter(items_in_stock__gt=0)
+                )
             ).data
             data['offers'] = offers_data
 
         return Response(data)
+
+    def destroy(self, request, *args, **kwargs):
+        return self._delete_products([self.get_object().pk])
+
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        serializer = ProductDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self._delete_products(serializer.validated_data['ids'])
+
+    @staticmethod
+    def _delete_products(product_ids) -> Response:
+        # Products disappear right away, their Offers are removed in the background
+        with transaction.atomic():
+            deleted_ids = soft_delete_products(product_ids)
+            if deleted_ids:
+                transaction.on_commit(
+                    lambda: purge_deleted_products_task.delay([str(id) for id in deleted_ids])
+                )
+
+        return Response(
+            ProductDeleteSerializer({'ids': deleted_ids}).data, status=status.HTTP_202_ACCEPTED
+        )
     
-    @extend_schema(
-        parameters=[
-            OpenApiParameter(name='fromDay', type=str, location=OpenApiParameter.QUERY, description='Start Date of comparison (DD.MM.YYYY)'),
-            OpenApiParameter(name='toDay', type=str, location=OpenApiParameter.QUERY, description='End Date of comparison (DD.MM.YYYY). If none provided Present Day will be used'),
-        ],
-    )
     @action(detail=True, methods=['get'])
     def price_change(self, request, pk=None):
         product = self.get_object()
+        record_product_read(product.pk)
         from_day_str = request.query_params.get('fromDay', False)
         if not from_day_str:
             return Response(
@@ -133,47 +347,132 @@ class ProductViewSet(AuthenticationMixin, ModelViewSet, OffersServiceMixin):
             }
         )
 
+    @action(detail=True, methods=['get'])
+    def stream(self, request, pk=None):
+        return self._stream_response(self.get_object().pk)
+
+    @action(detail=False, methods=['get'], url_path='stream', url_name='stream-all')
+    def stream_all(self, request):
+        return self._stream_response()
+
+    @staticmethod
+    def _stream_response(product_id=None):
+        offer_stream = open_offer_stream(product_id)
+        if offer_stream is None:
+            # Leaves web server threads for the rest of the API
+            response = JsonResponse(
+                {'error': 'Too many open streams, try again later.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+            response['Retry-After'] = str(settings.OFFER_STREAM_RETRY)
+            return response
+
+        # Streams don't query the database, so they shouldn't hold a connection
+        if not connection.in_atomic_block:
+            connection.close()
+        response = StreamingHttpResponse(offer_stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _include_offers(self) -> bool:
+        return self.request.query_params.get('includeOffers') in ['1', 'True', 'true']
+
     @staticmethod
     def _calculate_avg_price_for_day(product: Product, day_str: str):
+        # Each price event holds until the next event of its Offer. Like before
+        # the event log, every Offer in stock at some point of the day counts
+        # once, with its last price of the day
+        events = OfferPriceEvent.objects.filter(product=product)
         if day_str:
             datetime_bot = datetime.strptime(day_str + ' +0000', '%d.%m.%Y %z')
             datetime_top = datetime_bot + timedelta(days=1)
-
-            q = Q(created_at__lt=datetime_top) & (
-                Q(closed_at__gt=datetime_bot) | Q(closed_at__isnull=True)
-            )
+            events = events.filter(created_at__lt=datetime_top)
+            q = Q(next_created_at__gt=datetime_bot) | Q(next_created_at__isnull=True)
         else:
-            q = Q(closed_at__isnull=True)
-        avg_price = product.offers.filter(q).aggregate(avg_price=Avg('price'))[
-            'avg_price'
-        ]
+            q = Q(next_created_at__isnull=True)
+        day_events = events.annotate(
+            next_created_at=Window(
+                Lead('created_at'), partition_by='offer_id', order_by=['created_at', 'id']
+            )
+        ).filter(q)
+        avg_price = (
+            # The stock filter would otherwise go inside the Lead window
+            OfferPriceEvent.objects.filter(id__in=day_events.values('id'), items_in_stock__gt=0)
+            .annotate(
+                position=Window(
+                    RowNumber(), partition_by='offer_id', order_by=['-created_at', '-id']
+                )
+            )
+            .filter(position=1)
+            .aggregate(avg_price=Avg('price'))['avg_price']
+        )
         try:
             return round(avg_price, 2)
         except:
             return 0
 
 
-class OfferViewSet(AuthenticationMixin, ReadOnlyModelViewSet, OffersServiceMixin):
-    queryset = Offer.objects.all()
+class OfferViewSet(
+    AuthenticationMixin, ReplicaReadMixin, ValuesListMixin, ReadOnlyModelViewSet, OffersServiceMixin
+):
+    queryset = Offer.objects.filter(product__deleted_at__isnull=True).only(
+        *OfferSerializer.Meta.fields
+    )
     serializer_class = OfferSerializer
+    values_serializer_class = OfferValuesSerializer
+    filter_backends = [OfferFilter]
+    pagination_class = OfferPagination
+    throttle_scope = 'offers'
+
+
+class OffersWebhookView(APIView):
+    """
+    Receives batches of Offer changes pushed by the Offers Microservice.
+    Requests are signed with HMAC-SHA256 of `{timestamp}.{body}` using
+    OFFERS_WEBHOOK_SECRET, sent in `X-Offers-Timestamp` and
+    `X-Offers-Signature: sha256=<hex digest>` headers.
+    """
+
+    authentication_classes = []
+    throttle_classes = []
+    serializer_class = OfferEventSerializer
+
+    def post(self, request, format=None):
+        if not self._has_valid_signature(request):
+            return HttpResponseForbidden('Invalid signature')
+
+        events = request.data.get('events') if isinstance(request.data, dict) else None
+        if not isinstance(events, list):
+            return Response(
+                {"error": "You need to provide list of Offer events in 'events'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = OfferEventSerializer(data=events, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        return Response(apply_offer_events(serializer.validated_data))
+
+    @staticmethod
+    def _has_valid_signature(request) -> bool:
+        secret = settings.OFFERS_WEBHOOK_SECRET
+        timestamp = request.headers.get('X-Offers-Timestamp', '')
+        signature = request.headers.get('X-Offers-Signature', '')
+        if not secret or not timestamp.isdigit():
+            return False
+        if abs(time.time() - int(timestamp)) > settings.OFFERS_WEBHOOK_TOLERANCE:
+            return False
+
+        expected = hmac.new(
+            secret.encode(), timestamp.encode() + b'.' + request.body, hashlib.sha256
+        ).hexdigest()
+        return hmac.compare_digest(signature, f'sha256={expected}')
 
 
 class UsersView(APIView):
     serializer_class = UserSerializer
     
-    @extend_schema(
-        examples=[
-            OpenApiExample(
-                'Request Access-Token',
-                summary='Request Access-Token',
-                description='Generates Access-Token for given email.',
-                value={
-                    'email': 'testUser@gmail.com'
-                },
-                request_only=True,
-            ),
-        ]
-    )
     def post(self, request, format=None):
         email = request.data.get('email', False)
         if not email: